@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+import os
+import sys
+
+# copies a haplotypes file with the new haplotype count and appends the
+# haplotypes of the given markers, markers are indices of positions
+def append_haplotypes_file (haplotypes_filename, input_vcf_filename, positions, all_SNP_data, n_new, markers=None):
+    haplotypes_file = open(haplotypes_filename, "r")
+    n_haplotypes = int(haplotypes_file.readline())
+    n_SNPs = haplotypes_file.readline()
+    positions_line = haplotypes_file.readline()
+    if markers is None:
+        markers = range(len(positions))
+    if positions_line.split()[1:] != [positions[j] for j in markers]:
+        sys.stderr.write ("ERROR: markers of " + input_vcf_filename + " differ from " + haplotypes_filename + "\n")
+        sys.exit(1)
+
+    output_haplotypes_file = open(haplotypes_filename + ".tmp", "wb")
+    output_haplotypes_file.write(str(n_haplotypes + n_new * 2) + "\n")
+    output_haplotypes_file.write(n_SNPs)
+    output_haplotypes_file.write(positions_line)
+    for line in haplotypes_file:
+        output_haplotypes_file.write(line)
+    haplotypes_file.close()
+    for i in range(n_new):
+        ref = "".join(all_SNP_data[j][i][0] for j in markers)
+        alt = "".join(all_SNP_data[j][i][2] for j in markers)
+        output_haplotypes_file.write(ref + "\n" + alt + "\n")
+    output_haplotypes_file.close()
+    os.rename(haplotypes_filename + ".tmp", haplotypes_filename)
+
+# returns indices of the markers of a thinned haplotypes file in positions
+def thinned_markers (haplotypes_filename, positions):
+    haplotypes_file = open(haplotypes_filename, "r")
+    haplotypes_file.readline()
+    haplotypes_file.readline()
+    thinned_positions = haplotypes_file.readline().split()[1:]
+    haplotypes_file.close()
+    markers = []
+    j = 0
+    for position in thinned_positions:
+        while j < len(positions) and positions[j] != position:
+            j += 1
+        markers.append(j)
+        j += 1
+    return [j for j in markers if j < len(positions)]
+
+# recodes phased genotypes from the REF and ALT alleles of the new vcf file to
+# the alleles of the existing haplotypes, returns None if an allele is not in them
+def recode_genotypes (SNP_data, new_alleles, alleles):
+    codes = [str(alleles.index(allele)) if allele in alleles else None for allele in new_alleles]
+    recoded = []
+    for genotype in SNP_data:
+        haplotype_codes = [codes[int(genotype[0])], codes[int(genotype[2])]]
+        if None in haplotype_codes:
+            return None
+        recoded.append("|".join(haplotype_codes))
+    return recoded
+
+# appends the haplotypes of a phased vcf file to existing haplotypes and
+# hapids files, the vcf file must contain exactly the same markers
+# the genotypes are coded with the alleles of prefix.alleles
+# the thinned haplotypes file for parameter estimation is updated as well
+def append_haplotypes (filename_prefix, input_vcf_filename):
+    haplotypes_filename = filename_prefix + ".haplotypes"
+    em_haplotypes_filename = filename_prefix + ".em.haplotypes"
+    hapids_filename = filename_prefix + ".hapids"
+    alleles_filename = filename_prefix + ".alleles"
+
+    if not os.path.exists(alleles_filename):
+        sys.stderr.write ("ERROR: " + alleles_filename + " is missing, convert the phased data again\n")
+        sys.exit(1)
+
+    # reads new haplotypes
+    input_vcf_file = open(input_vcf_filename, "r")
+    alleles_file = open(alleles_filename, "r")
+    positions = []
+    all_SNP_data = []
+    for line in input_vcf_file:
+        if line[0:2] == "##":
+            continue
+        data = line.strip().split("\t")
+        if data[0] == "#CHROM":
+            sample_ids = data[9:]
+            continue
+        chromosome, position, ref, alt = (alleles_file.readline().split() + [None] * 4)[:4]
+        if (chromosome, position) != (data[0], data[1]):
+            sys.stderr.write ("ERROR: markers of " + input_vcf_filename + " differ from " + alleles_filename + "\n")
+            sys.exit(1)
+        SNP_data = recode_genotypes(data[9:], [data[3], data[4]], [ref, alt])
+        if SNP_data is None:
+            sys.stderr.write ("ERROR: alleles " + data[3] + "/" + data[4] + " of marker " + data[0] + ":" + data[1] + " in " + input_vcf_filename + " do not match " + ref + "/" + alt + "\n")
+            sys.exit(1)
+        positions.append(data[1])
+        all_SNP_data.append(SNP_data)
+    input_vcf_file.close()
+    if alleles_file.readline():
+        sys.stderr.write ("ERROR: markers of " + input_vcf_filename + " differ from " + alleles_filename + "\n")
+        sys.exit(1)
+    alleles_file.close()
+
+    append_haplotypes_file(haplotypes_filename, input_vcf_filename, positions, all_SNP_data, len(sample_ids))
+    if os.path.exists(em_haplotypes_filename):
+        markers = thinned_markers(em_haplotypes_filename, positions)
+        append_haplotypes_file(em_haplotypes_filename, input_vcf_filename, positions, all_SNP_data, len(sample_ids), markers)
+
+    hapids_file = open(hapids_filename, "a")
+    hapids_file.write("\n".join(sample_ids) + "\n")
+    hapids_file.close()
+
+
+prefix = sys.argv[1]
+vcf = sys.argv[2]
+append_haplotypes (prefix, vcf)
@@ -1,24 +1,207 @@
 #!/bin/sh
 
 ## Beagle pipeline for one chromosome
+## usage: beagle.sh datapath prefix chromosome [window overlap [reference]]
+## Chromosomes with more than $window markers are split into windows of $window
+## markers where neighbouring windows share $overlap markers. The windows are
+## phased concurrently and stitched back together. window=0 phases the whole
+## chromosome at once. If the prefix of an earlier phased data set is given as
+## reference, its phased chromosome is used as reference panel. If the file
+## datapath/prefix.regions exists, only markers inside its comma separated
+## chromosome:start-end regions are phased. With STREAM=1 in the environment
+## the .ped and .map slices and the .vcf are named pipes, not temporary files.
+## At most MAX_JOBS (default: a job per 4 cores) Beagle runs of all beagle.sh
+## processes of the same datapath run at once.
 
 # current chromosome number
 chromosome=$3
+window=${4:-0}
+overlap=${5:-0}
+reference=""
+panel=""
+if [ -n "$6" ]; then
+	panel=${1}chrom/${6}.$3.phased.vcf.gz
+	if [ ! -f $panel ]; then
+		panel=${1}chrom/${6}.$3.phased.vcf
+	fi
+	reference="ref=$panel impute=false"
+fi
+
+# Beagle runs take one of max_jobs slots, slots are locks shared by all
+# chromosomes and released when the run ends
+max_jobs=${MAX_JOBS:-$(($(nproc) / 4))}
+if [ $max_jobs -lt 1 ]; then
+	max_jobs=1
+fi
+slots=${1}chrom/.beagle.slot
+
+# runs a command in a free slot, waits until one is free
+in_slot () {
+	while true; do
+		for k in $(seq 1 $max_jobs); do
+			flock -n -E 99 $slots.$k "$@"
+			slot_status=$?
+			if [ $slot_status -ne 99 ]; then
+				return $slot_status
+			fi
+		done
+		sleep 5
+	done
+}
 
 # get start of current chromosome and number of SNPs from current chromosome
 first=$(($(grep -P -n "^${chromosome}\t" ${1}${2}.map | cut -f 1 -d : | head -n 1)+6))
 last=$(($(grep -P -n "^${chromosome}\t" ${1}${2}.map | cut -f 1 -d : | tail -n 1)+6))
 
+# indices of the chromosome's markers that are phased
+selected=${1}chrom/${2}.$3.selected
+regions=""
+if [ -f ${1}${2}.regions ]; then
+	regions=$(cat ${1}${2}.regions)
+	grep -P "^${chromosome}\t" ${1}${2}.map | python ./pipeline/genomic_regions.py "$regions" > $selected
+else
+	seq 1 $((last - first + 1)) > $selected
+fi
+nmarkers=$(wc -l < $selected)
+if [ $nmarkers -eq 0 ]; then
+	rm -f $selected
+	echo "No markers to phase on chromosome $3..."
+	exit 0
+fi
 
-# .ped to .vcf
+# index within the chromosome of the $1-th phased marker
+marker () {
+	sed -n "${1}p" $selected
+}
 
-# temporary files
-cut -f 1-6,${first}-${last} ${1}${2}.ped > ${1}chrom/${2}.$3.ped
-grep -P "^${chromosome}\t" ${1}${2}.map > ${1}chrom/${2}.$3.map
+# .ped and .map slices of phased markers $1 to $2 of the chromosome
+# into files prefixed with $3
+slice_ped () {
+	cut -f 1-6,$((first + $(marker $1) - 1))-$((first + $(marker $2) - 1)) ${datapath}${prefix}.ped > ${3}.ped
+}
+slice_map () {
+	grep -P "^${chromosome}\t" ${datapath}${prefix}.map | sed -n "$(marker $1),$(marker $2)p" > ${3}.map
+}
 
-# convert to .vcf
-./pipeline/bioinformatics_format_convert.py input_file_1=${1}chrom/${2}.$3.ped input_file_2=${1}chrom/${2}.$3.map input_type=PLINK output_file_1=${1}chrom/${2}.$3.vcf output_type=VCF
-# phase
-java -Xmx4000m -jar ./beagle.r1398.jar gt=${1}chrom/${2}.$3.vcf out=${1}chrom/${2}.$3.phased nthreads=4 > ${1}chrom/log$3
-echo "Finished phasing chromosome $3..."
+# .ped to .vcf, markers between regions are dropped
+# with a reference panel, REF and ALT alleles are taken from the panel
+to_vcf () {
+	./pipeline/bioinformatics_format_convert.py input_file_1=${1}.ped input_file_2=${1}.map input_type=PLINK output_file_1=${1}.vcf output_type=VCF ${regions:+regions=$regions} ${panel:+alleles=$panel}
+}
+
+# waits for the writer process $2 of the named pipe $1, if $3 is not 0 a stage
+# has failed and the pipe is read empty meanwhile, so that the writer
+# finishes also if its reader is gone or never opened the pipe
+finish_writer () {
+	if [ -z "$2" ]; then
+		return 0
+	fi
+	drain=""
+	if [ $3 -ne 0 ] && [ -p $1 ]; then
+		cat <> $1 > /dev/null &
+		drain=$!
+	fi
+	wait $2
+	writer_status=$?
+	if [ -n "$drain" ]; then
+		kill $drain 2> /dev/null
+		wait $drain 2> /dev/null
+	fi
+	return $writer_status
+}
 
+# .ped to .vcf and phasing of phased markers $1 to $2 of the chromosome
+# output files are prefixed with $3
+# with STREAM=1 the stages run concurrently, joined by named pipes
+# instead of temporary files, Beagle reads its input from a named pipe only
+# if STREAM_BEAGLE=1 (script.sh checks that Beagle reads a pipe in one pass)
+# returns non-zero and removes the output if any stage failed
+phase () {
+	if [ -n "$BENCHMARK_RUNS" ]; then
+		echo run >> $BENCHMARK_RUNS
+	fi
+	status=0
+	ped_pid=""
+	map_pid=""
+	vcf_pid=""
+	if [ "$STREAM" = "1" ]; then
+		rm -f ${3}.ped ${3}.map ${3}.vcf
+		mkfifo ${3}.ped ${3}.map
+		slice_ped $1 $2 $3 &
+		ped_pid=$!
+		slice_map $1 $2 $3 &
+		map_pid=$!
+		if [ "$STREAM_BEAGLE" = "1" ]; then
+			mkfifo ${3}.vcf
+			to_vcf $3 &
+			vcf_pid=$!
+		else
+			to_vcf $3 || status=1
+		fi
+	else
+		# temporary files
+		slice_ped $1 $2 $3
+		slice_map $1 $2 $3
+		to_vcf $3 || status=1
+	fi
+	# phase
+	if [ $status -eq 0 ]; then
+		in_slot java -Xmx4000m -jar ./beagle.r1398.jar gt=${3}.vcf $reference out=${3}.phased nthreads=4 > ${3}.log || status=1
+	fi
+	if [ "$STREAM" = "1" ]; then
+		# writers are waited for from Beagle's input upwards, a pipe is only
+		# drained after its reader has finished
+		finish_writer ${3}.vcf "$vcf_pid" $status || status=1
+		finish_writer ${3}.ped "$ped_pid" $status || status=1
+		finish_writer ${3}.map "$map_pid" $status || status=1
+		rm -f ${3}.ped ${3}.map ${3}.vcf
+	fi
+	if [ $status -ne 0 ]; then
+		echo "ERROR: phasing of $3 failed, see ${3}.log" >&2
+		rm -f ${3}.phased.vcf.gz
+	fi
+	return $status
+}
+
+datapath=$1
+prefix=$2
+out=${1}chrom/${2}.$3
+
+if [ $window -le 0 ] || [ $nmarkers -le $window ]; then
+	if ! phase 1 $nmarkers $out; then
+		rm -f $selected
+		exit 1
+	fi
+elif [ $overlap -ge $window ]; then
+	echo "ERROR: overlap ($overlap) must be smaller than window ($window)" >&2
+	exit 1
+else
+	# phase overlapping windows concurrently
+	windows=""
+	start=1
+	while true; do
+		end=$((start + window - 1))
+		if [ $end -gt $nmarkers ]; then
+			end=$nmarkers
+		fi
+		phase $start $end $out.w$start &
+		windows="$windows $out.w$start.phased.vcf.gz"
+		if [ $end -eq $nmarkers ]; then
+			break
+		fi
+		start=$((end - overlap + 1))
+	done
+	wait
+
+	# stitch windows into one chromosome file, failed windows have no output
+	for w in $windows; do
+		if [ ! -f $w ]; then
+			rm -f $windows $selected
+			exit 1
+		fi
+	done
+	python ./pipeline/stitch_phased_windows.py $out.phased.vcf.gz $windows
+	rm -f $windows
+fi
+rm -f $selected
+echo "Finished phasing chromosome $3..."
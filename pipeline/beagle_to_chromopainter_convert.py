@@ -1,56 +1,289 @@
-#!/usr/bin/python 
+#!/usr/bin/python
 
+import os
 import sys
+import gzip
+import numpy
+import hashlib
+from genomic_regions import normalise_chromosome, parse_regions, in_regions
+
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# reads a HapMap style genetic map with columns Chromosome, Position(bp),
+# Rate(cM/Mb) and Map(cM), header lines of concatenated maps are skipped
+def read_genetic_map (filename):
+    genetic_map = {}
+    f = gzip.open(filename, "rb") if filename.endswith(".gz") else open(filename, "r")
+    for line in f:
+        data = line.split()
+        if len(data) < 4 or not data[1].isdigit():
+            continue
+        chromosome = normalise_chromosome(data[0])
+        bp, cM = genetic_map.setdefault(chromosome, ([], []))
+        bp.append(int(data[1]))
+        cM.append(float(data[3]))
+    f.close()
+    return dict((chromosome, (numpy.array(bp, dtype=float), numpy.array(cM))) for chromosome, (bp, cM) in genetic_map.items())
+
+# per bp recombination rates in Morgans between markers, genetic positions of
+# the markers are interpolated from the map and extrapolated with the mean
+# rate of the chromosome outside it, chromosomes missing from the map get the
+# constant rate 0.0000001
+def genetic_map_rates (chromosomes, positions, map_filename):
+    genetic_map = read_genetic_map(map_filename)
+    chromosomes = numpy.array([normalise_chromosome(c) for c in chromosomes])
+    positions = numpy.array(positions, dtype=float)
+    genetic_positions = positions * 0.00001
+    for chromosome in numpy.unique(chromosomes):
+        if chromosome not in genetic_map:
+            sys.stderr.write ("WARNING: chromosome " + chromosome + " is missing from " + map_filename + ", using a constant rate\n")
+            continue
+        bp, cM = genetic_map[chromosome]
+        mean_rate = (cM[-1] - cM[0]) / (bp[-1] - bp[0]) if bp[-1] > bp[0] else 0.0
+        markers = chromosomes == chromosome
+        x = positions[markers]
+        y = numpy.interp(x, bp, cM)
+        y = numpy.where(x < bp[0], cM[0] - (bp[0] - x) * mean_rate, y)
+        y = numpy.where(x > bp[-1], cM[-1] + (x - bp[-1]) * mean_rate, y)
+        genetic_positions[markers] = y
+
+    distances = numpy.diff(positions)
+    rates = numpy.where(distances > 0, numpy.diff(genetic_positions) / 100.0 / numpy.maximum(distances, 1), 0.0)
+    rates = numpy.where(chromosomes[1:] != chromosomes[:-1], -9, numpy.maximum(rates, 0.0))
+    return ["-9" if rate == -9 else "%.10g" % rate for rate in rates] + ["0"]
+
+# rates of genetic_map_rates cached in cache_dir by the markers and the content of the map
+def cached_genetic_map_rates (chromosomes, positions, map_filename, cache_dir):
+    key = hashlib.sha1()
+    for chromosome, position in zip(chromosomes, positions):
+        key.update(chromosome + ":" + position + "\n")
+    f = open(map_filename, "rb")
+    for block in iter(lambda: f.read(BUFFER_SIZE), ""):
+        key.update(block)
+    f.close()
+    cache_filename = os.path.join(cache_dir, key.hexdigest() + ".recomrates")
+
+    if os.path.isfile(cache_filename):
+        return read_recomrates(cache_filename)
+    rates = genetic_map_rates(chromosomes, positions, map_filename)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    write_recomrates(cache_filename + ".tmp", positions, rates)
+    os.rename(cache_filename + ".tmp", cache_filename)
+    return rates
+
+# writes a recombination rate file, rates[i] is the rate between markers i and i+1
+def write_recomrates (filename, positions, rates):
+    output_recomrates_file = open(filename, "wb")
+    output_recomrates_file.write("start.pos\trecom.rate.perbp\n")
+    for position, rate in zip(positions, rates):
+        output_recomrates_file.write(position + "\t" + rate + "\n")
+    output_recomrates_file.close()
+
+# writes a haplotypes file of the given markers
+def write_haplotypes (filename, n_individuals, positions, all_SNP_data, markers):
+    output_haplotypes_file = open(filename, "wb")
+    output_haplotypes_file.write(str(n_individuals * 2) + "\n")
+    output_haplotypes_file.write(str(len(markers)) + "\n")
+    output_haplotypes_file.write("P " + " ".join(positions[j] for j in markers) + "\n")
+    for i in range(n_individuals):
+        ref = "".join(all_SNP_data[j][i][0] for j in markers)
+        alt = "".join(all_SNP_data[j][i][2] for j in markers)
+        output_haplotypes_file.write(ref + "\n" + alt + "\n")
+    output_haplotypes_file.close()
+
+# writes a haplotypes file of the given markers of an existing haplotypes file
+def write_thinned_haplotypes (filename, haplotypes_filename, markers):
+    input_haplotypes_file = open(haplotypes_filename, "r")
+    n_haplotypes = input_haplotypes_file.readline()
+    input_haplotypes_file.readline()
+    positions = input_haplotypes_file.readline().split()[1:]
+    output_haplotypes_file = open(filename, "wb")
+    output_haplotypes_file.write(n_haplotypes)
+    output_haplotypes_file.write(str(len(markers)) + "\n")
+    output_haplotypes_file.write("P " + " ".join(positions[j] for j in markers) + "\n")
+    for line in input_haplotypes_file:
+        haplotype = line.rstrip("\n")
+        output_haplotypes_file.write("".join(haplotype[j] for j in markers) + "\n")
+    input_haplotypes_file.close()
+    output_haplotypes_file.close()
+
+# reads chromosomes and positions of the markers from prefix.alleles
+def read_markers (filename):
+    chromosomes = []
+    positions = []
+    f = open(filename, "r")
+    for line in f:
+        data = line.split("\t")
+        chromosomes.append(data[0])
+        positions.append(data[1])
+    f.close()
+    return chromosomes, positions
+
+# reads the rates of a recombination rate file
+def read_recomrates (filename):
+    f = open(filename, "r")
+    f.readline()
+    rates = [line.split()[1] for line in f]
+    f.close()
+    return rates
+
+# the constant rate 0.0000001 between markers, -9 between chromosomes
+def constant_rates (chromosomes):
+    rates = []
+    for a, b in zip(chromosomes, chromosomes[1:]):
+        rates.append("0.0000001" if a == b else "-9")
+    rates.append("0")
+    return rates
+
+# selects markers for the parameter estimation: the first marker of every
+# chromosome and after it the markers that are at least every markers and
+# min_spacing bp away from the previously selected one
+def thin_markers (chromosomes, positions, every=1, min_spacing=0):
+    markers = []
+    for j in range(len(positions)):
+        if not markers or chromosomes[j] != chromosomes[markers[-1]]:
+            markers.append(j)
+        elif j - markers[-1] >= every and int(positions[j]) - int(positions[markers[-1]]) >= min_spacing:
+            markers.append(j)
+    return markers
+
+# recombination rates between selected markers that keep the genetic distances
+# of the full data: the sum of rate * length of the skipped intervals divided
+# by the length of the thinned interval
+def thinned_rates (chromosomes, positions, rates, markers):
+    genetic_position = [0.0]
+    for j in range(1, len(positions)):
+        if chromosomes[j] != chromosomes[j - 1]:
+            genetic_position.append(0.0)
+        else:
+            genetic_position.append(genetic_position[-1] + float(rates[j - 1]) * (int(positions[j]) - int(positions[j - 1])))
+    thinned = []
+    for a, b in zip(markers, markers[1:]):
+        if chromosomes[a] != chromosomes[b]:
+            thinned.append("-9")
+        elif positions[a] == positions[b]:
+            thinned.append(rates[a])
+        else:
+            thinned.append("%.10g" % ((genetic_position[b] - genetic_position[a]) / (int(positions[b]) - int(positions[a]))))
+    thinned.append("0")
+    return thinned
+
+# writes the thinned files for the parameter estimation from the full
+# haplotypes and rates, old ones are removed when not thinning, the settings
+# are recorded in prefix.em.settings
+def write_em_files (filename_prefix, chromosomes, positions, rates, every=1, min_spacing=0):
+    output_em_prefix = filename_prefix + ".em"
+    if every > 1 or min_spacing > 0:
+        markers = thin_markers(chromosomes, positions, every, min_spacing)
+        write_recomrates(output_em_prefix + ".recomrates", [positions[j] for j in markers], thinned_rates(chromosomes, positions, rates, markers))
+        write_thinned_haplotypes(output_em_prefix + ".haplotypes", filename_prefix + ".haplotypes", markers)
+    else:
+        for suffix in [".haplotypes", ".recomrates"]:
+            if os.path.exists(output_em_prefix + suffix):
+                os.remove(output_em_prefix + suffix)
+    output_settings_file = open(output_em_prefix + ".settings", "w")
+    output_settings_file.write("thin_every=" + str(every) + " thin_bp=" + str(min_spacing) + "\n")
+    output_settings_file.close()
+
+# rewrites only the thinned files of existing haplotypes, recombination rates
+# and markers, i.e. when the thinning settings have changed, individuals
+# appended to the haplotypes after the conversion are kept
+def update_em_files (filename_prefix, every=1, min_spacing=0):
+    chromosomes, positions = read_markers(filename_prefix + ".alleles")
+    rates = read_recomrates(filename_prefix + ".recomrates")
+    write_em_files(filename_prefix, chromosomes, positions, rates, every, min_spacing)
+
+# rewrites only the recombination rates of existing markers and the thinned
+# rates of the parameter estimation, i.e. when the genetic map has changed,
+# the haplotypes and the individuals appended to them are kept
+def update_recomrates (filename_prefix, every=1, min_spacing=0, genetic_map=None, cache_dir=None):
+    chromosomes, positions = read_markers(filename_prefix + ".alleles")
+    if genetic_map:
+        rates = cached_genetic_map_rates(chromosomes, positions, genetic_map, cache_dir or os.path.join(os.path.dirname(filename_prefix), "ratecache"))
+    else:
+        rates = constant_rates(chromosomes)
+    write_recomrates(filename_prefix + ".recomrates", positions, rates)
+    if (every > 1 or min_spacing > 0) and os.path.exists(filename_prefix + ".em.haplotypes"):
+        markers = thin_markers(chromosomes, positions, every, min_spacing)
+        write_recomrates(filename_prefix + ".em.recomrates", [positions[j] for j in markers], thinned_rates(chromosomes, positions, rates, markers))
 
 # takes info from vcb and creates haplotypes and recombination rate files
-def vcf_to_haplotypes_and_recomrates_convert (filename_prefix):
+# if regions are given, only markers inside them are used
+# if every or min_spacing are given, thinned files for the parameter
+# estimation are also written to prefix.em.haplotypes and prefix.em.recomrates
+# if a genetic map is given, recombination rates are taken from it instead of
+# the constant rate and cached in cache_dir
+def vcf_to_haplotypes_and_recomrates_convert (filename_prefix, regions=None, every=1, min_spacing=0, genetic_map=None, cache_dir=None):
     input_vcf_filename = filename_prefix + ".phased.vcf"
     output_haplotypes_filename = filename_prefix + ".haplotypes"
     output_recomrates_filename = filename_prefix + ".recomrates"
-    
-    input_vcf_file = open(input_vcf_filename, "r")
-    
-    offset = 0
-    is_first_data_row = False
+    output_hapids_filename = filename_prefix + ".hapids"
+    output_alleles_filename = filename_prefix + ".alleles"
+
+    # the phased data may be compressed or a named pipe
+    if os.path.exists(input_vcf_filename):
+        input_vcf_file = open(input_vcf_filename, "r")
+    else:
+        input_vcf_file = gzip.open(input_vcf_filename + ".gz", "rb")
+
     for line in input_vcf_file:
-        offset += len(line)
-        if is_first_data_row:
-            break
         if line[0:6] == "#CHROM":
-            n_individuals = len(line.split("\t")) - 9
-            is_first_data_row = True
-    data = line.strip().split("\t")
-    last_SNP = data[0]
-    positions = [data[1]]
-    all_SNP_data = [data[9:]]
-    
-    # writes recombination rate file
-    output_recomrates_file = open(output_recomrates_filename, "wb")
-    output_recomrates_file.write("start.pos\trecom.rate.perbp\n")
-    for line in input_vcf_file:
-        data = line.strip().split("\t")
-        output_recomrates_file.write(positions[-1] + "\t" + ("0.0000001" if last_SNP == data[0] else "-9") + "\n")
-        last_SNP = data[0]
+            sample_ids = line.strip().split("\t")[9:]
+            n_individuals = len(sample_ids)
+            break
+    data_rows = (line.strip().split("\t") for line in input_vcf_file)
+    if regions:
+        regions = parse_regions(regions)
+        data_rows = (data for data in data_rows if in_regions(data[0], int(data[1]), regions))
+    chromosomes = []
+    positions = []
+    all_SNP_data = []
+    alleles = []
+    for data in data_rows:
+        chromosomes.append(data[0])
         positions.append(data[1])
         all_SNP_data.append(data[9:])
-    output_recomrates_file.write(positions[-1] + "\t0\n") 
-    output_recomrates_file.close()
-    
-    # writes haplotypes file
-    output_haplotypes_file = open(output_haplotypes_filename, "wb")
-    output_haplotypes_file.write(str(n_individuals * 2) + "\n")
-    output_haplotypes_file.write(str(len(positions)) + "\n")
-    output_haplotypes_file.write("P " + " ".join(positions) + "\n")
-    for i in range(n_individuals):
-        ref = alt = ""
-        for SNP_data in all_SNP_data:
-            ref += SNP_data[i][0]
-            alt += SNP_data[i][2]
-        output_haplotypes_file.write(ref + "\n" + alt + "\n")
-    output_haplotypes_file.close()
-    
+        alleles.append(data[3] + "\t" + data[4])
     input_vcf_file.close()
-    
+    if genetic_map:
+        rates = cached_genetic_map_rates(chromosomes, positions, genetic_map, cache_dir or os.path.join(os.path.dirname(filename_prefix), "ratecache"))
+    else:
+        rates = constant_rates(chromosomes)
+
+    write_recomrates(output_recomrates_filename, positions, rates)
+    write_haplotypes(output_haplotypes_filename, n_individuals, positions, all_SNP_data, range(len(positions)))
+
+    write_em_files(filename_prefix, chromosomes, positions, rates, every, min_spacing)
+
+    # writes sample ids in the order of haplotypes
+    output_hapids_file = open(output_hapids_filename, "w")
+    output_hapids_file.write("\n".join(sample_ids) + "\n")
+    output_hapids_file.close()
+
+    # writes REF and ALT alleles of the markers, 0 and 1 in the haplotypes
+    output_alleles_file = open(output_alleles_filename, "w")
+    for chromosome, position, marker_alleles in zip(chromosomes, positions, alleles):
+        output_alleles_file.write(chromosome + "\t" + position + "\t" + marker_alleles + "\n")
+    output_alleles_file.close()
+
 
+# optional arguments are regions and key=value options: thin_every=k and
+# thin_bp=d for the thinned files, genetic_map=file and rate_cache=directory,
+# update=em rewrites only the thinned files and update=rates only the
+# recombination rates of an existing conversion
 prefix = sys.argv[1]
-vcf_to_haplotypes_and_recomrates_convert (prefix)
\ No newline at end of file
+regions = None
+options = {"thin_every" : "1", "thin_bp" : "0", "genetic_map" : None, "rate_cache" : None, "update" : None}
+for arg in sys.argv[2:]:
+    if "=" in arg:
+        key, value = arg.split("=", 1)
+        options[key] = value
+    else:
+        regions = arg
+if options["update"] == "em":
+    update_em_files (prefix, int(options["thin_every"]), int(options["thin_bp"]))
+elif options["update"] == "rates":
+    update_recomrates (prefix, int(options["thin_every"]), int(options["thin_bp"]), options["genetic_map"], options["rate_cache"])
+else:
+    vcf_to_haplotypes_and_recomrates_convert (prefix, regions, int(options["thin_every"]), int(options["thin_bp"]), options["genetic_map"], options["rate_cache"])
@@ -45,11 +45,17 @@ Convert between various bioinformatics formats. The supported formats are:
 ** This should be the MAP file for PLINK, the TFAM file for TPLINK, the markers file for BEAGLE, the sample file IMPUTE2, the DAT file for MERLIN and None for VCF.
 * input_type : Available values are: PLINK, TPLINK, BEAGLE, IMPUTE2, MERLIN, VCF
 * output_file_1, output_file_2 the correspondent output files according to selected output format. For VCF this can be None.
+* Input and output files can be named pipes. '-' stands for standard input or standard output
 * output_type : The format of the output files. The available options are the same as with input_type
 * chromosome : In case the input format does not have chromosome information (i.e. BEAGLE) you can define it here. Only string is allowed
 * phenotype : In case the input format supports multiple phenotypes (i.e. IMPUTE2) you can define which one should be picked.
 * gender : In case the input format supported multiple phenotypes and does not make any distinction between a regular phenotype and gender (i.e. IMPUTE2) you can put the name of the phenotype that corresponds to gender.
 * silent: set True to suppress output
+* threads: set above 1 to run the reader, the record formatting and the (compressed) output writing as separate stages. Compression of .gz outputs is then done by a pool of 'threads' workers
+* compression_level: zlib compression level (1-9) of .gz outputs. Outputs ending with .gz are written in block-gzip (BGZF) format. Compressed inputs are detected from their content
+* max_memory: memory budget for batches of genotypes, i.e. 2G. Batch sizes are chosen from the number of samples and the measured size of genotypes instead of genotypes_per_batch
+* regions: convert only markers inside these regions. A list or a comma separated string of chromosome:start-end regions, i.e. 1:1000000-2000000,2
+* alleles: a VCF file whose REF and ALT alleles are used for the VCF output instead of the alleles ordered by their frequency in the converted samples, i.e. the reference panel the output is phased against
 
 [[Category:Validated]]
 [[Category:Algorithms]]
@@ -62,12 +68,20 @@ Convert between various bioinformatics formats. The supported formats are:
 import os
 import re
 import glob
-import gzip
+import io
+import stat
+import zlib
+import Queue
+import struct
 import numpy
 import tempfile
+import threading
 import mimetypes
 import itertools
 import sys
+import genomic_regions
+
+from multiprocessing.pool import ThreadPool
 
 
 class progress_bar():
@@ -96,6 +110,223 @@ class progress_bar():
 	def __str__(self):
 		return str(self.prog_bar)
 
+# Size of read and write buffers
+BUFFER_SIZE = 4194304
+
+GZIP_MAGIC = '\x1f\x8b'
+
+# Maximum uncompressed size of a BGZF block, as used by samtools/htslib
+BGZF_BLOCK_SIZE = 65280
+
+# Empty BGZF block marking the end of a BGZF file
+BGZF_EOF = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+class gzip_reader():
+	'''
+	Reads lines from a gzip compressed stream.
+	Handles files with multiple gzip members (i.e. BGZF) and does not need to seek,
+	so it can be used on pipes.
+	'''
+
+	def __init__(self, stream, buffer_size=BUFFER_SIZE):
+		self.stream = stream
+		self.buffer_size = buffer_size
+		self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		self.lines = self.__lines()
+
+	def __chunks(self):
+		while True:
+			data = self.stream.read(self.buffer_size)
+			if not data:
+				break
+			while data:
+				yield self.decompressor.decompress(data)
+				data = self.decompressor.unused_data
+				if data:
+					# Next gzip member
+					self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		yield self.decompressor.flush()
+
+	def __lines(self):
+		rest = ''
+		for chunk in self.__chunks():
+			lines = (rest + chunk).split('\n')
+			rest = lines.pop()
+			for line in lines:
+				yield line + '\n'
+		if rest:
+			yield rest
+
+	def __iter__(self):
+		return self.lines
+
+	def readline(self):
+		return next(self.lines, '')
+
+	def read(self):
+		return ''.join(self.lines)
+
+	def close(self):
+		self.stream.close()
+
+class block_writer():
+	'''
+	A file-like object that writes to 'filename' in a background thread.
+	Written data are collected into blocks of 'block_size' bytes.
+	If compress is True every block is compressed into BGZF blocks by a pool of 'threads' workers.
+	BGZF files are valid gzip files that can also be indexed by tabix/samtools.
+	At most 'queue_size' blocks are waiting to be written.
+	'''
+
+	def __init__(self, filename, threads=1, compress=True, compression_level=6, block_size=1048576, queue_size=None):
+		self.file = open(filename, 'wb', BUFFER_SIZE)
+		self.compress = compress
+		self.compression_level = compression_level
+		self.block_size = block_size
+		self.buffer = []
+		self.buffer_size = 0
+		self.pool = ThreadPool(threads) if compress else None
+		self.queue = Queue.Queue(queue_size or 2 * threads)
+		self.error = None
+		self.thread = threading.Thread(target=self.__write_blocks)
+		self.thread.daemon = True
+		self.thread.start()
+
+	@staticmethod
+	def compress_block(data, compression_level=6):
+		'''
+		Compresses data into consecutive BGZF blocks
+		'''
+		blocks = []
+		for start in range(0, len(data), BGZF_BLOCK_SIZE):
+			block = data[start:start + BGZF_BLOCK_SIZE]
+			compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+			compressed = compressor.compress(block) + compressor.flush()
+			# gzip header with the BC extra field holding the total block size - 1
+			blocks.append(struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25))
+			blocks.append(compressed)
+			blocks.append(struct.pack('<II', zlib.crc32(block) & 0xffffffff, len(block)))
+		return ''.join(blocks)
+
+	def __write_blocks(self):
+		while True:
+			block = self.queue.get()
+			if block is None:
+				break
+			try:
+				self.file.write(block.get() if self.compress else block)
+			except Exception as e:
+				self.error = e
+
+	def __flush_buffer(self):
+		if not self.buffer:
+			return
+		data = ''.join(self.buffer)
+		self.buffer = []
+		self.buffer_size = 0
+		if self.compress:
+			self.queue.put(self.pool.apply_async(block_writer.compress_block, (data, self.compression_level)))
+		else:
+			self.queue.put(data)
+
+	def write(self, data):
+		if self.error:
+			raise self.error
+		self.buffer.append(data)
+		self.buffer_size += len(data)
+		if self.buffer_size >= self.block_size:
+			self.__flush_buffer()
+
+	def close(self):
+		self.__flush_buffer()
+		self.queue.put(None)
+		self.thread.join()
+		if self.pool:
+			self.pool.close()
+			self.pool.join()
+			self.file.write(BGZF_EOF)
+		self.file.close()
+		if self.error:
+			raise self.error
+
+class memory_budget():
+	'''
+	Chooses batch sizes so that the batches of all 'parts' stages fit in 'max_memory' bytes.
+	The memory per value is measured on the data with measure().
+	If the memory of the process grows more than max_memory over the memory it used
+	when the budget was created, later batches are made smaller until it stops growing.
+	Batches have at least 'min_batch_bytes' bytes, so that an input is not re-read for
+	every few records, and at least one record. If a batch has to be larger than the
+	budget of its part, a warning is written to standard error.
+	'''
+
+	def __init__(self, max_memory, parts=1, min_batch_bytes=8 * 1024 ** 2):
+		self.max_memory = max_memory
+		self.parts = parts
+		self.min_batch_bytes = min_batch_bytes
+		self.warned = False
+		self.bytes_per_value = None
+		self.scale = 1.0
+		self.baseline = memory_budget.used_memory()
+		self.last_used = self.baseline
+
+	@staticmethod
+	def parse_size(value):
+		'''
+		Converts sizes like '512M' or '2G' to bytes
+		'''
+		units = {'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3, 'T' : 1024 ** 4}
+		value = str(value).upper().rstrip('B')
+		if value and value[-1] in units:
+			return int(float(value[:-1]) * units[value[-1]])
+		return int(value)
+
+	@staticmethod
+	def used_memory():
+		'''
+		Resident memory of this process in bytes. None if it is not available
+		'''
+		try:
+			f = open('/proc/self/statm')
+			resident_pages = int(f.read().split()[1])
+			f.close()
+			return resident_pages * os.sysconf('SC_PAGE_SIZE')
+		except (IOError, OSError, ValueError, IndexError):
+			return None
+
+	def measure(self, values):
+		'''
+		values: a sample of the values that will be stored in batches
+		Each value costs its object, a list pointer and a numpy string cell when transposed
+		'''
+		values = values[:1000]
+		if not values:
+			return
+		measured = sum(sys.getsizeof(value) + 8 + len(value) for value in values) / float(len(values))
+		self.bytes_per_value = max(self.bytes_per_value, measured)
+
+		# Resident memory is rarely returned, so only growth above the budget shrinks batches
+		used = memory_budget.used_memory()
+		if used is None or self.baseline is None:
+			return
+		if used - self.baseline > self.max_memory and used > self.last_used:
+			self.scale /= 2
+		elif self.scale < 1.0:
+			self.scale = min(1.0, self.scale * 2)
+		self.last_used = used
+
+	def batch_size(self, values_per_record):
+		'''
+		Number of records with 'values_per_record' values that fit in one batch
+		'''
+		record_bytes = max(values_per_record, 1) * (self.bytes_per_value or 64)
+		budget = self.max_memory * self.scale / self.parts
+		batch_bytes = max(budget, self.min_batch_bytes, record_bytes)
+		if batch_bytes > self.max_memory / self.parts and not self.warned:
+			sys.stderr.write('Warning: batches of %d MB exceed the memory budget of %d MB per part\n' % (batch_bytes // 1024 ** 2, self.max_memory // self.parts // 1024 ** 2))
+			self.warned = True
+		return int(batch_bytes / record_bytes)
+
 class bioinformatics_file_helper:
 	'''
 	This is a collection of common functions used commonly
@@ -122,6 +353,20 @@ class bioinformatics_file_helper:
 			count_sorted = {x : flat_genotypes.count(x) for x in all_alleles}
 			return sorted(count_sorted, key=lambda x : count_sorted[x])[::-1]  # Sort and revert
 
+	@staticmethod
+	def read_vcf_alleles(filename):
+		'''
+		filename: a VCF file
+		returns: a dictionary from (chromosome, position) to the (REF, ALT) alleles of the file
+		'''
+
+		alleles = {}
+		for vcf_c, vcf_s in bioinformatics_file_helper.line_generator(filename):
+			if vcf_s[0][0] == '#':
+				continue
+			alleles[(genomic_regions.normalise_chromosome(vcf_s[0]), vcf_s[1])] = (vcf_s[3], vcf_s[4])
+		return alleles
+
 	@staticmethod
 	def get_chromosome_files(path, chromosome_exp=r'chr%(chromosome)s'):
 		'''
@@ -200,31 +445,45 @@ class bioinformatics_file_helper:
 		return f.write(sep.join(line) + '\n')
 
 	@staticmethod
-	def open_file_read(filename, mode='rU'):
+	def open_file_read(filename):
 		'''
 		Checks the type of filename and returns a file or a string stream
+		gzip compressed files are detected from their first bytes
+		'-' reads from standard input
 		'''
 		if type(filename) is str:
+			if filename == '-':
+				filename = '/dev/stdin'
+			f = io.open(filename, 'rb', buffering=BUFFER_SIZE)
+
 			# Check if file is a gzip
-			if mimetypes.guess_type(filename)[1] == 'gzip':
-				return gzip.open(filename, 'rb')
+			if f.peek(2)[:2] == GZIP_MAGIC:
+				return gzip_reader(f)
 
-			return open(filename, mode)
+			return f
 		else:
 			filename.seek(0)
 			return filename
 
 	@staticmethod
-	def open_file_write(filename):
+	def open_file_write(filename, threads=1, compression_level=6):
 		'''
 		Checks the type of filename and returns a file or a string stream
+		Filenames ending with .gz are written in BGZF format, compressed by 'threads' workers
+		If threads > 1, uncompressed files are written in a background thread
+		'-' writes to standard output
 		'''
 		if type(filename) is str:
+			if filename == '-':
+				filename = '/dev/stdout'
 
 			if mimetypes.guess_type(filename)[1] == 'gzip':
-				return gzip.open(filename, 'wb')
+				return block_writer(filename, threads, compression_level=compression_level)
+
+			if threads > 1:
+				return block_writer(filename, threads, compress=False)
 
-			return open(filename, 'w')
+			return open(filename, 'w', BUFFER_SIZE)
 		else:
 			return filename
 
@@ -233,9 +492,66 @@ class bioinformatics_file_helper:
 		'''
 		Checks the type of filesource and closes the file
 		'''
-		if type(stream) is file:
+		if type(stream) is file or isinstance(stream, (io.BufferedReader, gzip_reader, block_writer)):
 			stream.close()
 
+	@staticmethod
+	def region_filter(reader, regions):
+		'''
+		Passes the header and the records of reader that are inside one of the regions
+		'''
+		regions = genomic_regions.parse_regions(regions)
+
+		yield reader.next()
+		for record in reader:
+			if genomic_regions.in_regions(record['chromosome'], int(record['position']), regions):
+				yield record
+
+	@staticmethod
+	def threaded_generator(generator, queue_size=1000):
+		'''
+		Runs 'generator' in a background thread.
+		Yields its items through a queue holding at most 'queue_size' items
+		'''
+
+		queue = Queue.Queue(queue_size)
+		finished = object()
+		error = []
+
+		def produce():
+			try:
+				for item in generator:
+					queue.put(item)
+			except Exception:
+				error.append(sys.exc_info())
+			queue.put(finished)
+
+		thread = threading.Thread(target=produce)
+		thread.daemon = True
+		thread.start()
+
+		while True:
+			item = queue.get()
+			if item is finished:
+				break
+			yield item
+
+		if error:
+			raise error[0][0], error[0][1], error[0][2]
+
+	@staticmethod
+	def is_pipe(filename):
+		'''
+		True if filename is a named pipe or standard input/output connected to a pipe.
+		Pipes can be read only once
+		'''
+		if filename == '-':
+			filename = '/dev/stdin'
+		try:
+			return type(filename) is str and stat.S_ISFIFO(os.stat(filename).st_mode)
+		except OSError:
+			return False
+
 	@staticmethod
 	def line_generator(filename):
 		'''
@@ -254,20 +570,39 @@ class bioinformatics_file_helper:
 		bioinformatics_file_helper.close_file(read_from)
 
 	@staticmethod
-	def column_generator(filename, batch_size=10000):
+	def column_generator(filename, batch_size=10000, budget=None):
 		'''
 		filename: a filename or open file
 		Reads a column of a file.
 		After 'batch_size' reads reopens the file
+		If a memory_budget is given, batch_size is chosen from the number of lines and the size of the values
+		Pipes cannot be reopened, so they are read in one batch
 		yields a tuple: current column, line
 		'''
 
 		start_column = 0
 		line_counter = 0
+		lines = None
+		pipe = bioinformatics_file_helper.is_pipe(filename)
+		if pipe:
+			batch_size = sys.maxint
+			budget = None
+		if budget and type(filename) is str:
+			# Estimate number of lines from the first line
+			f = bioinformatics_file_helper.open_file_read(filename)
+			first_line = f.readline()
+			bioinformatics_file_helper.close_file(f)
+			budget.measure(first_line.split())
+			if first_line and not isinstance(f, gzip_reader):
+				lines = max(1, os.path.getsize(filename) // len(first_line))
+
 		while True:
 			to_return = []
 			finished = False
 
+			if budget and lines:
+				batch_size = budget.batch_size(lines)
+
 			f = bioinformatics_file_helper.open_file_read(filename)
 			for l in f:
 				s = l.replace('\n', '').split()
@@ -285,6 +620,10 @@ class bioinformatics_file_helper:
 
 			bioinformatics_file_helper.close_file(f)
 
+			if budget:
+				budget.measure(to_return[0])
+				lines = len(to_return)
+
 			# Transpose
 			to_return_transposed = numpy.transpose(to_return)
 
@@ -293,14 +632,18 @@ class bioinformatics_file_helper:
 				line_counter += 1
 				yield line_counter, list(line)
 
+			if pipe:
+				break
+
 			start_column += batch_size
 
 	@staticmethod
-	def column_writer(filename, batch_size=10000, silent=False):
+	def column_writer(filename, batch_size=10000, silent=False, budget=None):
 		'''
 		Saves to file column by column.
 		It is implemented as a generator
 		If this method consumes too much memory, try lowering the batch_size    
+		If a memory_budget is given, batch_size is chosen from the size of the records
 		To suppress output set silent=True
 
 		Example:
@@ -313,24 +656,36 @@ class bioinformatics_file_helper:
 		'''
 
 		finished = False
+		old_temp_filename = None
 		while not finished:
 			current_batch = []
-			for current_record in range(batch_size):
+			while len(current_batch) < batch_size:
 				data = (yield True)
 				if not data:
 					finished = True
 					break
 				current_batch += [data]
+				if budget and len(current_batch) == 1:
+					budget.measure(data)
+					batch_size = budget.batch_size(len(data))
 
 			if current_batch:
 				current_batch_transposed = numpy.transpose(current_batch)
 
-				new_temp_file = tempfile.NamedTemporaryFile(delete=False)
+				new_temp_file = tempfile.NamedTemporaryFile(delete=False, bufsize=BUFFER_SIZE)
 				if not silent:
 					print 'Created: ', new_temp_file.name
 
-				for line in current_batch_transposed:
-					bioinformatics_file_helper.line_writer(new_temp_file, line)
+				if old_temp_filename:
+					# Append the columns of this batch to the columns of the previous batches
+					old_temp_file = bioinformatics_file_helper.open_file_read(old_temp_filename)
+					for old_line, line in itertools.izip(old_temp_file, current_batch_transposed):
+						bioinformatics_file_helper.line_writer(new_temp_file, [old_line.rstrip('\n')] + list(line))
+					bioinformatics_file_helper.close_file(old_temp_file)
+					os.unlink(old_temp_filename)
+				else:
+					for line in current_batch_transposed:
+						bioinformatics_file_helper.line_writer(new_temp_file, line)
 
 				old_temp_filename = new_temp_file.name
 				new_temp_file.close()
@@ -344,7 +699,7 @@ class bioinformatics_file_helper:
 			temp_file = bioinformatics_file_helper.open_file_read(old_temp_filename)
 			for l in temp_file:
 				filename.write(l)
-			bioinformatics_file_helper.close_file(old_temp_filename)
+			bioinformatics_file_helper.close_file(temp_file)
 			os.unlink(old_temp_filename)
 			if not silent:
 				print 'Delete: ', old_temp_filename
@@ -353,7 +708,7 @@ class bioinformatics_file_helper:
 
 
 
-def BEAGLE_writer(beagle_filename, markers_filename, reader):
+def BEAGLE_writer(beagle_filename, markers_filename, reader, threads=1, compression_level=6):
 	'''
 	Write in beagle genotype format
 	Description: http://faculty.washington.edu/browning/beagle/beagle_3.3.2_31Oct11.pdf 
@@ -361,8 +716,8 @@ def BEAGLE_writer(beagle_filename, markers_filename, reader):
 
 	bfh = bioinformatics_file_helper()
 
-	beagle_file = bfh.open_file_write(beagle_filename)
-	markers_file = bfh.open_file_write(markers_filename)
+	beagle_file = bfh.open_file_write(beagle_filename, threads, compression_level)
+	markers_file = bfh.open_file_write(markers_filename, threads, compression_level)
 
 	header = reader.next()
 	sample_names = header['sample_ids']
@@ -397,7 +752,7 @@ def BEAGLE_writer(beagle_filename, markers_filename, reader):
 	bfh.close_file(markers_file)
 
 
-def PLINK_writer(ped_filename, map_filename, reader, genotypes_per_batch=10000, silent=False):
+def PLINK_writer(ped_filename, map_filename, reader, genotypes_per_batch=10000, silent=False, threads=1, compression_level=6, budget=None):
 	'''
 	Save plink's format ped_map file
 	format description: http://pngu.mgh.harvard.edu/~purcell/plink/data.shtml#ped
@@ -409,7 +764,7 @@ def PLINK_writer(ped_filename, map_filename, reader, genotypes_per_batch=10000,
 	header = reader.next()
 
 	# Save header
-	ped_writer = bfh.column_writer(ped_filename, genotypes_per_batch, silent=silent)
+	ped_writer = bfh.column_writer(ped_filename, genotypes_per_batch, silent=silent, budget=budget)
 	ped_writer.next()
 	ped_writer.send(header['family_ids'])
 	ped_writer.send(header['sample_ids'])
@@ -419,7 +774,7 @@ def PLINK_writer(ped_filename, map_filename, reader, genotypes_per_batch=10000,
 	ped_writer.send(header['phenotype_ids'])
 
 	# Save markers
-	map_file = bfh.open_file_write(map_filename)
+	map_file = bfh.open_file_write(map_filename, threads, compression_level)
 	for marker in reader:
 		ped_writer.send([genotype[0] for genotype in marker['genotypes']])
 		ped_writer.send([genotype[1] for genotype in marker['genotypes']])
@@ -438,9 +793,10 @@ def PLINK_writer(ped_filename, map_filename, reader, genotypes_per_batch=10000,
 	# Close map file
 	bfh.close_file(map_file)
 
-def VCF_writer(vcf_filename, reader):
+def VCF_writer(vcf_filename, reader, threads=1, compression_level=6, alleles=None):
 	'''
 	Description: http://www.1000genomes.org/wiki/Analysis/Variant%20Call%20Format/vcf-variant-call-format-version-41 
+	alleles: a dictionary from (chromosome, position) to fixed (REF, ALT) alleles of markers
 	'''
 
 	bfh = bioinformatics_file_helper()
@@ -453,9 +809,9 @@ def VCF_writer(vcf_filename, reader):
 		elif genotype == alt:
 			return '1'
 		else:
-			raise Exception('more than one alternatives are not supported by this converter')
+			raise Exception('allele %s is neither REF %s nor ALT %s, more than one alternatives are not supported by this converter' % (genotype, ref, alt))
 
-	vcf_file = bfh.open_file_write(vcf_filename)
+	vcf_file = bfh.open_file_write(vcf_filename, threads, compression_level)
 
 	header = reader.next()
 
@@ -470,17 +826,22 @@ def VCF_writer(vcf_filename, reader):
 
 	for record in reader:
 	
-		alleles = bfh.get_alleles(record['genotypes'])
+		chromosome = genomic_regions.normalise_chromosome(record['chromosome'])
+		if alleles and (chromosome, record['position']) in alleles:
+			ref, alt = alleles[(chromosome, record['position'])]
+		else:
+			ref, alt = bfh.get_alleles(record['genotypes'])[:2]
+			alt = alt if alt <> '0' else 'N'
 
 		to_write = [
 			record['chromosome'],
 			record['position'],
 			record['rs_id'],
-			alleles[0],
-			alleles[1] if alleles[1] <> '0' else 'N',
+			ref,
+			alt,
 			'.', '.', '.',
 			'GT',
-		] +   ['/'.join([vcf_genotype(alleles[0], alleles[1], allele) for allele in gen_pair]) for gen_pair in record['genotypes']]
+		] +   ['/'.join([vcf_genotype(ref, alt, allele) for allele in gen_pair]) for gen_pair in record['genotypes']]
 		
 		bfh.line_writer(vcf_file, to_write)
 
@@ -604,7 +965,7 @@ def BEAGLE_reader(beagle_filename, marker_filename, chromosome):
 			'genotypes' : [(beagle_data[1][i], beagle_data[1][i + 1]) for i in range(2, (samples * 2) + 1, 2)],
 		}
 
-def PLINK_reader(ped_filename, map_filename, genotypes_per_batch=10000):
+def PLINK_reader(ped_filename, map_filename, genotypes_per_batch=10000, budget=None):
 	'''
 	generator for a plink's PED and MAP file
 	format description: http://pngu.mgh.harvard.edu/~purcell/plink/data.shtml#ped
@@ -623,7 +984,7 @@ def PLINK_reader(ped_filename, map_filename, genotypes_per_batch=10000):
 		positions += [map_s[3]]
 
 	# Read ped file column by column
-	ped_reader = bfh.column_generator(ped_filename, genotypes_per_batch)
+	ped_reader = bfh.column_generator(ped_filename, genotypes_per_batch, budget)
 
 	# yield header 
 	yield {
@@ -656,10 +1017,18 @@ def bioinformatics_format_convert(
 	phenotype='pheno',
 	gender='gender',
 	genotypes_per_batch=10000,
-	silent=True):
+	silent=True,
+	threads=1,
+	compression_level=6,
+	max_memory=None,
+	regions=None,
+	alleles=None):
+
+	# The memory budget is shared by the reader and the writer
+	budget = memory_budget(memory_budget.parse_size(max_memory), parts=2) if max_memory else None
 
 	if input_type == 'PLINK':
-		reader = PLINK_reader(input_file_1, input_file_2)
+		reader = PLINK_reader(input_file_1, input_file_2, genotypes_per_batch, budget)
 	elif input_type == 'BEAGLE':
 		reader = BEAGLE_reader(input_file_1, input_file_2, chromosome)
 	elif input_type == 'VCF':
@@ -667,12 +1036,30 @@ def bioinformatics_format_convert(
 	else:
 		raise Exception('Unknowm file type: %s in parameter input_type' % (str(input_type)))
 
+	if regions:
+		reader = bioinformatics_file_helper.region_filter(reader, regions)
+
+	if threads > 1:
+		# Parse input in a separate thread
+		queue_size = 1000
+		if budget:
+			# Size the queue of records from the first record
+			header = reader.next()
+			first_record = next(reader, None)
+			if first_record:
+				budget.measure(first_record['genotypes'])
+				queue_size = budget.batch_size(len(first_record['genotypes']))
+				reader = itertools.chain([header, first_record], reader)
+			else:
+				reader = iter([header])
+		reader = bioinformatics_file_helper.threaded_generator(reader, queue_size)
+
 	if output_type == 'PLINK':
-		PLINK_writer(output_file_1, output_file_2, reader, silent=silent)
+		PLINK_writer(output_file_1, output_file_2, reader, genotypes_per_batch=genotypes_per_batch, silent=silent, threads=threads, compression_level=compression_level, budget=budget)
 	elif output_type == 'BEAGLE':
-		BEAGLE_writer(output_file_1, output_file_2, reader)
+		BEAGLE_writer(output_file_1, output_file_2, reader, threads=threads, compression_level=compression_level)
 	elif output_type == 'VCF':
-		VCF_writer(output_file_1, reader)
+		VCF_writer(output_file_1, reader, threads=threads, compression_level=compression_level, alleles=bioinformatics_file_helper.read_vcf_alleles(alleles) if alleles else None)
 	else:
 		raise Exception('Unknown file type: %s in parameter output_type' % (str(output_type)))
 
@@ -683,7 +1070,7 @@ def bioinformatics_format_convert(
 
 
 
-arguments = {"input_file_1":"", "input_file_2":"", "input_type":"", "output_file_1":"", "output_file_2":"", "output_type":""}
+arguments = {"input_file_1":"", "input_file_2":"", "input_type":"", "output_file_1":"", "output_file_2":"", "output_type":"", "threads":"1", "compression_level":"6", "max_memory":"", "regions":"", "alleles":""}
 # Method name =bioinformatics_format_convert()
 if __name__ == '__main__':
 	for i in range(1, len(sys.argv)):
@@ -699,7 +1086,12 @@ if __name__ == '__main__':
 											input_type = arguments["input_type"], 
 											output_file_1 = arguments["output_file_1"], 
 											output_file_2 = arguments["output_file_2"], 
-											output_type = arguments["output_type"])
+											output_type = arguments["output_type"],
+											threads = int(arguments["threads"]),
+											compression_level = int(arguments["compression_level"]),
+											max_memory = arguments["max_memory"] or None,
+											regions = arguments["regions"] or None,
+											alleles = arguments["alleles"] or None)
 	if returned:
 		print 'Method returned:'
 		print str(returned)
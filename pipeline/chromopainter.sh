@@ -8,26 +8,53 @@ if [ $s -le 5 ]; then
 	s=5
 fi
 
-# estimating parameters
-for i in $(seq 1 $s); do
-	r=$RANDOM
-	n=$(( $r % $3 ))
-	../ChromoPainterv2 -a 0 0 -i 10 -in -iM -s 0 -g ${1}${2}.haplotypes -r ${1}${2}.recomrates -t ${1}${2}.idfile -f ${1}${2}.poplist $n $n -o $1EMest/${2}.$n > $1EMest/log.$n &
-done
-wait
+# parameters are estimated on the thinned markers of the converter if they exist
+em=${1}${2}
+if [ -f ${1}${2}.em.haplotypes ] && [ -f ${1}${2}.em.recomrates ]; then
+	em=${1}${2}.em
+fi
 
-# calculating final parameters for the actual run
-./neaverage.pl -o ${1}${2}.neaverage.txt ${1}EMest/${2}.*.EMprobs.out
+# parameters are estimated again only if the markers, rates, populations or
+# donor haplotypes have changed, appended recipients keep them and so the
+# painting cache
+emkey=$(python ./pipeline/painting_cache.py em_key ${1}${2} $em)
+if [ ! -f ${1}${2}.neaverage.txt ] || [ "$(cat ${1}${2}.neaverage.key 2> /dev/null)" != "$emkey" ]; then
+	# estimating parameters, outputs of earlier data or populations are not averaged
+	rm -f ${1}EMest/${2}.* ${1}EMest/log.*
+	for i in $(seq 1 $s); do
+		r=$RANDOM
+		n=$(( $r % $3 ))
+		if [ -n "$BENCHMARK_RUNS" ]; then
+			echo em >> $BENCHMARK_RUNS
+		fi
+		../ChromoPainterv2 -a 0 0 -i 10 -in -iM -s 0 -g ${em}.haplotypes -r ${em}.recomrates -t ${1}${2}.idfile -f ${1}${2}.poplist $n $n -o $1EMest/${2}.$n > $1EMest/log.$n &
+	done
+	wait
+
+	# calculating final parameters for the actual run
+	./neaverage.pl -o ${1}${2}.neaverage.txt ${1}EMest/${2}.*.EMprobs.out
+	echo "$emkey" > ${1}${2}.neaverage.key
+fi
 necmd=$(cat ${1}${2}.neaverage.txt)
-
-# actual ChromoPainter run
-../ChromoPainterv2 -s 10 $necmd -g ${1}${2}.haplotypes -r ${1}${2}.recomrates -t ${1}${2}.idfile -f ${1}${2}.poplist 0 0 -o ${1}${2} > ${1}${2}.log
-
-
-
-
-
-
-
-
-
+params="-s 10 $necmd"
+
+# actual ChromoPainter run, only recipients missing from the painting cache are painted
+# outputs of earlier runs are removed, a run that succeeded leaves a .ok file
+cache=${1}paintcache
+mkdir -p $cache ${1}paint
+rm -f ${1}paint/${2}.* ${1}paint/log.*
+jobs=$(nproc)
+i=0
+for n in $(python ./pipeline/painting_cache.py misses ${1}${2} $cache "$params"); do
+	if [ -n "$BENCHMARK_RUNS" ]; then
+		echo run >> $BENCHMARK_RUNS
+	fi
+	{ ../ChromoPainterv2 $params -g ${1}${2}.haplotypes -r ${1}${2}.recomrates -t ${1}${2}.idfile -f ${1}${2}.poplist $n $n -o ${1}paint/${2}.$n > ${1}paint/log.$n && touch ${1}paint/${2}.$n.ok; } &
+	i=$((i + 1))
+	if [ $((i % jobs)) -eq 0 ]; then
+		wait
+	fi
+done
+wait
+python ./pipeline/painting_cache.py store ${1}${2} $cache "$params" ${1}paint/${2}
+python ./pipeline/painting_cache.py assemble ${1}${2} $cache "$params" ${1}${2}
@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+import os
 import sys
 
 # get donors and recipients from commandline
@@ -55,14 +56,26 @@ def collect_statistics (file, populations):
       used.append(pop) 
       stats[pop] = 1 
 
+# reads individuals from the .fam file in the order of haplotypes
+# (.hapids file) if haplotypes have been created
+def read_individuals (prefix):
+  fr = open (prefix + ".fam", "r")
+  individuals = [line.strip().split() for line in fr]
+  fr.close()
+  if not os.path.isfile (prefix + ".hapids"):
+    return individuals
+  by_id = dict((ind[1], ind) for ind in individuals)
+  fr = open (prefix + ".hapids", "r")
+  ordered = [by_id[line.strip()] for line in fr if line.strip()]
+  fr.close()
+  return ordered
+
 # creates idfile for chromopainter
 def create_id_file (prefix, donors, recipients):
   fw = open (prefix + ".idfile", "w") 
-  fr = open (prefix + ".fam", "r")
   stat = {}
   n = 0
-  for line in fr:
-    ind = line.strip().split()
+  for ind in read_individuals (prefix):
     if ind[0] in stat: 
       stat[ind[0]] += 1
     else:
@@ -73,7 +86,6 @@ def create_id_file (prefix, donors, recipients):
     else:
       fw.write (ind[0] + str(stat[ind[0]]) + "\t" + ind[0] + "\t0\n")
   fw.close()
-  fr.close()
   return n
 
 # creates parameter file for globetrotter
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+## Comma separated chromosome:start-end regions, i.e. "chr1:1000000-5000000,22"
+## Chromosome names are compared without a "chr" prefix on both sides.
+## usage: genomic_regions.py regions < map
+## prints line numbers of the PLINK .map lines (chromosome, id, cM, position)
+## of standard input that are inside the regions
+
+import sys
+
+# chromosome name without a chr prefix
+def normalise_chromosome (chromosome):
+    if chromosome.lower().startswith("chr"):
+        return chromosome[3:]
+    return chromosome
+
+# parses a list or a comma separated string of regions into
+# (chromosome, start, end) tuples, start and end are None if not given
+def parse_regions (regions):
+    if isinstance(regions, str):
+        regions = regions.split(",")
+    parsed = []
+    for region in regions:
+        chromosome, _, interval = region.strip().partition(":")
+        start, _, end = interval.partition("-")
+        parsed.append((normalise_chromosome(chromosome), int(start) if start else None, int(end) if end else None))
+    return parsed
+
+# reads the regions of a file, i.e. prefix.regions
+def read_regions (filename):
+    f = open(filename, "r")
+    regions = parse_regions(f.read().strip())
+    f.close()
+    return regions
+
+def in_regions (chromosome, position, regions):
+    chromosome = normalise_chromosome(chromosome)
+    for region_chromosome, start, end in regions:
+        if chromosome == region_chromosome and (start is None or position >= start) and (end is None or position <= end):
+            return True
+    return False
+
+
+if __name__ == "__main__":
+    regions = parse_regions(sys.argv[1])
+    for n, line in enumerate(sys.stdin):
+        data = line.split()
+        if in_regions(data[0], int(data[3]), regions):
+            sys.stdout.write (str(n + 1) + "\n")
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+## Runs the GLOBETROTTER bootstraps of prefix.param in independent shards
+## usage: globetrotter_bootstrap.py prefix shards [bootstraps [seed]]
+## Every shard is a GLOBETROTTER run with its own .param file and random seed.
+## The bootstraps of all shards are merged into the save.file.bootstraps file
+## of prefix.param, the main results and the log are taken from the first shard.
+## bootstrap.num of prefix.param is set to the number of merged bootstraps.
+
+import os
+import sys
+import subprocess
+from multiprocessing import Pool
+
+GLOBETROTTER = "GLOBETROTTER.R"
+
+# reads a globetrotter parameter file into a list of (key, value) pairs
+def read_parameters (filename):
+    f = open(filename, "r")
+    parameters = [line.rstrip("\n").split(":", 1) for line in f if ":" in line]
+    f.close()
+    return [(key, value.strip()) for key, value in parameters]
+
+def write_parameters (filename, parameters):
+    f = open(filename, "w")
+    for key, value in parameters:
+        f.write (key + ": " + value + "\n")
+    f.close()
+
+# writes parameter files of the shards, returns their prefixes
+def create_shards (prefix, shards, bootstraps):
+    parameters = read_parameters(prefix + ".param")
+    if bootstraps is None:
+        bootstraps = int(dict(parameters)["bootstrap.num"])
+    else:
+        parameters = [(key, str(bootstraps) if key == "bootstrap.num" else value) for key, value in parameters]
+        write_parameters(prefix + ".param", parameters)
+    shards = max(1, min(shards, bootstraps))
+
+    shard_prefixes = []
+    for k in range(shards):
+        shard_prefix = prefix + ".shard" + str(k + 1)
+        n = bootstraps // shards + (1 if k < bootstraps % shards else 0)
+        shard_parameters = []
+        for key, value in parameters:
+            if key == "bootstrap.num":
+                value = str(n)
+            elif key == "save.file.main":
+                value = shard_prefix + ".globetrotter.main"
+            elif key == "save.file.bootstraps":
+                value = shard_prefix + ".globetrotter.boot"
+            shard_parameters.append((key, value))
+        write_parameters(shard_prefix + ".param", shard_parameters)
+        shard_prefixes.append(shard_prefix)
+    return shard_prefixes
+
+# runs globetrotter for one shard with a fixed random seed
+def run_shard (arguments):
+    prefix, shard_prefix, seed = arguments
+    f = open(GLOBETROTTER, "r")
+    script = "set.seed(" + str(seed) + ")\n" + f.read()
+    f.close()
+    log = open(shard_prefix + ".globetrotter.log", "w")
+    r = subprocess.Popen(["R", shard_prefix + ".param", prefix + ".samples.out", prefix + ".recomrates", "--no-save"], stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT)
+    r.communicate(script)
+    log.close()
+    return r.returncode
+
+# merges bootstrap tables of the shards, keeping the header of the first one
+# if the first column is the bootstrap index, the indices of later shards are
+# shifted by the number of bootstraps of the shards before them
+def merge_bootstraps (shard_prefixes, output_filename):
+    fw = open(output_filename, "w")
+    offset = 0
+    for k, shard_prefix in enumerate(shard_prefixes):
+        fr = open(shard_prefix + ".globetrotter.boot", "r")
+        header = fr.readline()
+        if k == 0:
+            fw.write (header)
+        columns = header.split()
+        indexed = len(columns) > 0 and columns[0].strip('"').lower().startswith("boot")
+        for line in fr:
+            index = line.split()[0] if line.strip() else ""
+            if indexed and offset and index.isdigit():
+                line = str(int(index) + offset) + line[len(index):]
+            fw.write (line)
+        fr.close()
+        offset += int(dict(read_parameters(shard_prefix + ".param"))["bootstrap.num"])
+    fw.close()
+
+def globetrotter_bootstrap (prefix, shards, bootstraps=None, seed=1):
+    shard_prefixes = create_shards(prefix, shards, bootstraps)
+
+    pool = Pool(len(shard_prefixes))
+    returncodes = pool.map(run_shard, [(prefix, shard_prefix, seed + k) for k, shard_prefix in enumerate(shard_prefixes)])
+    pool.close()
+    pool.join()
+    for shard_prefix, returncode in zip(shard_prefixes, returncodes):
+        if returncode != 0:
+            sys.stderr.write ("ERROR: GLOBETROTTER failed, see " + shard_prefix + ".globetrotter.log\n")
+            sys.exit(1)
+
+    parameters = dict(read_parameters(prefix + ".param"))
+    merge_bootstraps(shard_prefixes, parameters["save.file.bootstraps"])
+    os.rename(shard_prefixes[0] + ".globetrotter.main", parameters["save.file.main"])
+    os.rename(shard_prefixes[0] + ".globetrotter.log", prefix + ".globetrotter.log")
+    for shard_prefix in shard_prefixes:
+        for suffix in [".param", ".globetrotter.main", ".globetrotter.boot", ".globetrotter.log"]:
+            if os.path.isfile(shard_prefix + suffix):
+                os.remove(shard_prefix + suffix)
+
+
+prefix = sys.argv[1]
+shards = int(sys.argv[2])
+bootstraps = int(sys.argv[3]) if len(sys.argv) > 3 else None
+seed = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+globetrotter_bootstrap (prefix, shards, bootstraps, seed)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+## Cache of per-individual ChromoPainter outputs
+## usage:
+##   painting_cache.py misses prefix cachedir parameters
+##     prints the recipient indices that are not in the cache
+##   painting_cache.py store prefix cachedir parameters runprefix
+##     stores outputs of single recipient runs runprefix.<index>.*.out of
+##     the runs that succeeded, i.e. wrote runprefix.<index>.ok
+##   painting_cache.py assemble prefix cachedir parameters outprefix
+##     writes outprefix.*.out for all recipients from the cache
+##   painting_cache.py em_key prefix emprefix
+##     prints the key of the parameter estimation on emprefix.haplotypes and
+##     emprefix.recomrates, individuals that are not donors do not change it
+## An individual is cached by its name, its haplotypes, the haplotypes of all
+## donor individuals, the donor populations, the recombination rates and the
+## ChromoPainter parameters.
+
+import os
+import sys
+import shutil
+import hashlib
+
+OUTPUTS = ["chunklengths", "chunkcounts", "samples"]
+
+# returns recipient names and donor flags of individuals in haplotype order
+def read_individuals (prefix):
+    donor_pops = []
+    recipient_pops = []
+    f = open(prefix + ".poplist", "r")
+    for line in f:
+        pop, kind = line.split()
+        if kind == "D":
+            donor_pops.append(pop)
+        else:
+            recipient_pops.append(pop)
+    f.close()
+
+    recipients = []
+    donors = []
+    f = open(prefix + ".idfile", "r")
+    for i, line in enumerate(f):
+        name, pop, include = line.split()
+        if include != "1":
+            continue
+        if pop in recipient_pops:
+            recipients.append((i, name))
+        elif pop in donor_pops:
+            donors.append(i)
+    f.close()
+    return donor_pops, donors, recipients
+
+# returns a hash of the positions line of a haplotypes file and the hashes
+# of the haplotypes of every individual
+def haplotype_hashes (filename):
+    f = open(filename, "r")
+    f.readline()
+    f.readline()
+    shared = hashlib.sha1(f.readline())
+    individual_hashes = []
+    for line in f:
+        if len(individual_hashes) == 0 or individual_hashes[-1][1] == 2:
+            individual_hashes.append([hashlib.sha1(), 0])
+        individual_hashes[-1][0].update(line)
+        individual_hashes[-1][1] += 1
+    f.close()
+    return shared, individual_hashes
+
+def update_from_file (key, filename):
+    f = open(filename, "r")
+    for line in f:
+        key.update(line)
+    f.close()
+
+# returns cache keys of all recipients
+def cache_keys (prefix, parameters):
+    donor_pops, donors, recipients = read_individuals(prefix)
+    shared, individual_hashes = haplotype_hashes(prefix + ".haplotypes")
+    update_from_file(shared, prefix + ".recomrates")
+    shared.update(" ".join(sorted(donor_pops)) + "\n" + parameters + "\n")
+    for i in donors:
+        shared.update(individual_hashes[i][0].digest())
+
+    keys = []
+    for i, name in recipients:
+        key = shared.copy()
+        key.update(name + "\n" + individual_hashes[i][0].digest())
+        keys.append(key.hexdigest())
+    return keys
+
+# returns the key of the parameter estimation: the markers and rates of
+# em_prefix, the population list and the haplotypes of the donors, so that
+# appended recipients or unused individuals keep the estimated parameters
+def em_key (prefix, em_prefix):
+    donor_pops, donors, recipients = read_individuals(prefix)
+    key, individual_hashes = haplotype_hashes(em_prefix + ".haplotypes")
+    update_from_file(key, em_prefix + ".recomrates")
+    update_from_file(key, prefix + ".poplist")
+    for i in donors:
+        key.update(individual_hashes[i][0].digest())
+    return key.hexdigest()
+
+def cache_filename (cache_dir, key, output):
+    return os.path.join(cache_dir, key[:2], key + "." + output + ".out")
+
+def is_cached (cache_dir, key):
+    return all(os.path.isfile(cache_filename(cache_dir, key, output)) for output in OUTPUTS)
+
+# prints 1-based recipient indices missing from the cache
+def misses (prefix, cache_dir, parameters):
+    for n, key in enumerate(cache_keys(prefix, parameters)):
+        if not is_cached(cache_dir, key):
+            print (n + 1)
+
+# moves outputs of succeeded single recipient runs into the cache, outputs
+# of failed runs are left out so that the recipients are painted again
+def store (prefix, cache_dir, parameters, run_prefix):
+    for n, key in enumerate(cache_keys(prefix, parameters)):
+        run_filenames = [run_prefix + "." + str(n + 1) + "." + output + ".out" for output in OUTPUTS]
+        ok_filename = run_prefix + "." + str(n + 1) + ".ok"
+        if is_cached(cache_dir, key) or not os.path.isfile(ok_filename) or not all(os.path.isfile(f) for f in run_filenames):
+            continue
+        if not os.path.isdir(os.path.join(cache_dir, key[:2])):
+            os.makedirs(os.path.join(cache_dir, key[:2]))
+        for output, run_filename in zip(OUTPUTS, run_filenames):
+            shutil.move(run_filename, cache_filename(cache_dir, key, output) + ".tmp")
+        # the outputs of an individual are complete once all are renamed
+        for output in OUTPUTS:
+            os.rename(cache_filename(cache_dir, key, output) + ".tmp", cache_filename(cache_dir, key, output))
+        os.remove(ok_filename)
+
+# splits a single recipient output into its header and rows
+def read_output (filename, output):
+    f = open(filename, "r")
+    lines = f.readlines()
+    f.close()
+    if output == "samples":
+        n = 0
+        while n < len(lines) and not lines[n].startswith("HAP"):
+            n += 1
+        return lines[:n], lines[n:]
+    return lines[:1], lines[1:]
+
+# writes full output files for all recipients from the cache
+def assemble (prefix, cache_dir, parameters, output_prefix):
+    keys = cache_keys(prefix, parameters)
+    missing = [key for key in keys if not is_cached(cache_dir, key)]
+    if missing:
+        sys.stderr.write ("ERROR: " + str(len(missing)) + " recipients are not in the painting cache\n")
+        sys.exit(1)
+    for output in OUTPUTS:
+        f = open(output_prefix + "." + output + ".out", "w")
+        for n, key in enumerate(keys):
+            header, rows = read_output(cache_filename(cache_dir, key, output), output)
+            if n == 0:
+                f.writelines(header)
+            f.writelines(rows)
+        f.close()
+
+
+command = sys.argv[1]
+prefix = sys.argv[2]
+if command == "em_key":
+    print (em_key(prefix, sys.argv[3]))
+    sys.exit(0)
+cache_dir = sys.argv[3]
+parameters = sys.argv[4]
+if command == "misses":
+    misses (prefix, cache_dir, parameters)
+elif command == "store":
+    store (prefix, cache_dir, parameters, sys.argv[5])
+elif command == "assemble":
+    assemble (prefix, cache_dir, parameters, sys.argv[5])
+else:
+    sys.stderr.write ("ERROR: Unknown command: " + command + "\n")
+    sys.exit(1)
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+
+## Predicts wall time, peak memory and temporary disk of the pipeline stages
+## usage: plan_run.py prefix -d donor-populations -r recipient-populations
+##                    [-w window] [-o overlap] [-b bootstraps] [-s shards]
+##                    [--benchmarks file] [--dimensions] [--jobs stage]
+## Only the dimensions of the data set are read: individuals from prefix.fam,
+## markers per chromosome from prefix.bim or prefix.map (restricted to the
+## regions of prefix.regions if it exists) and donor/recipient individuals.
+## Every stage has a scaling model work = a * size^b (CPU seconds) and
+## memory = c * size^d (MB per process). The models are fitted to the runs
+## recorded by script.sh in the benchmarks file, stages without recorded
+## runs use rough defaults. Recorded runs of phasing and painting are sized
+## by the Beagle jobs, painted recipients and EM runs that actually ran,
+## painting runs that found everything cached are not used.
+## --dimensions prints the dimensions in the format of the benchmarks file.
+## --jobs prints the suggested number of concurrent processes of a stage.
+
+import os
+import sys
+import math
+import multiprocessing
+from genomic_regions import read_regions, in_regions
+
+MB = 1024.0 ** 2
+
+# dimensions of a data set
+class dimensions:
+    def __init__(self, samples, markers, donors, recipients, bootstraps, shards, window, overlap, jobs=None, em=None):
+        self.samples = samples
+        self.markers = markers  # dict of markers per chromosome
+        self.donors = donors
+        self.recipients = recipients
+        self.bootstraps = bootstraps
+        self.shards = shards
+        self.window = window
+        self.overlap = overlap
+        self.jobs = jobs  # recorded number of Beagle jobs
+        self.em = em      # recorded number of EM runs
+
+    def total_markers(self):
+        return sum(self.markers.values())
+
+    def genotypes(self):
+        return self.samples * self.total_markers()
+
+    def phasing_jobs(self):
+        # markers of every Beagle run
+        if self.jobs:
+            return [int(math.ceil(self.total_markers() / float(self.jobs)))] * self.jobs
+        jobs = []
+        for n in self.markers.values():
+            if self.window <= 0 or n <= self.window:
+                jobs.append(n)
+                continue
+            start = 1
+            while True:
+                end = min(start + self.window - 1, n)
+                jobs.append(end - start + 1)
+                if end == n:
+                    break
+                start = end - self.overlap + 1
+        return jobs
+
+    def em_runs(self):
+        if self.em is not None:
+            return self.em
+        return max(5, (self.donors + self.recipients) // 10)
+
+# a pipeline stage: size of its problem, how many processes it can run at once,
+# how many threads each process uses and how much temporary disk it needs
+class stage:
+    def __init__(self, name, size, processes, threads, disk, work, memory):
+        self.name = name
+        self.size = size
+        self.processes = processes
+        self.threads = threads
+        self.disk = disk
+        self.work = work          # default (a, b)
+        self.memory = memory      # default (c, d)
+
+STAGES = [
+    stage("plink",
+        lambda d: d.genotypes(),
+        lambda d: 1, 1,
+        lambda d: d.genotypes() * 4.0,
+        (4.5e-7, 1.0), (1.0e-6, 1.0)),
+    stage("phasing",
+        lambda d: d.genotypes(),
+        lambda d: len(d.phasing_jobs()), 4,
+        lambda d: d.samples * sum(d.phasing_jobs()) * 8.5,
+        (5.0e-5, 1.0), (2.0e-4, 0.8)),
+    stage("conversion",
+        lambda d: d.genotypes(),
+        lambda d: 1, 1,
+        lambda d: d.genotypes() * 2.0,
+        (2.0e-6, 1.0), (5.0e-5, 1.0)),
+    stage("painting",
+        lambda d: (d.recipients + 10 * d.em_runs()) * 2.0 * d.donors * d.total_markers(),
+        lambda d: d.recipients + d.em_runs(), 1,
+        lambda d: d.recipients * d.total_markers() * 40.0,
+        (1.0e-8, 1.0), (1.0e-7, 0.5)),
+    stage("globetrotter",
+        lambda d: (d.bootstraps + 1) * max(d.recipients, 1),
+        lambda d: max(1, min(d.shards, d.bootstraps)), 1,
+        lambda d: 0.0,
+        (3.0, 1.0), (50.0, 0.3)),
+]
+
+# reads recorded runs: stage, samples, markers, donors, recipients, bootstraps,
+# shards, window, overlap, cores, wall seconds, peak memory in KB, processes
+# run ("run" lines: Beagle jobs or painted recipients) and EM runs, the last
+# two are "-" for stages that do not count them
+def read_benchmarks (filename):
+    runs = {}
+    if not os.path.isfile(filename):
+        return runs
+    f = open(filename, "r")
+    for line in f:
+        data = line.strip().split("\t")
+        if len(data) not in [12, 14]:
+            continue
+        try:
+            samples, markers, donors, recipients, bootstraps, shards, window, overlap, cores = [int(x) for x in data[1:10]]
+            wall, rss = float(data[10]), float(data[11])
+            jobs, em = [int(x) if x != "-" else None for x in data[12:14]] or [None, None]
+        except ValueError:
+            continue
+        if data[0] == "painting":
+            # older rows do not tell what was painted, cached runs did not paint
+            if jobs is None or jobs + em == 0:
+                continue
+            recipients = jobs
+        d = dimensions(samples, {"all" : markers}, donors, recipients, bootstraps, shards, window, overlap, jobs if data[0] == "phasing" else None, em)
+        runs.setdefault(data[0], []).append((d, cores, wall, rss / 1024.0))
+    f.close()
+    return runs
+
+# least squares fit of log(y) = log(a) + b * log(x), the exponent of the
+# default model is kept if the recorded sizes do not differ
+def fit_power_law (points, default):
+    points = [(x, y) for x, y in points if x > 0 and y > 0]
+    if not points:
+        return default
+    lx = [math.log(x) for x, y in points]
+    ly = [math.log(y) for x, y in points]
+    mx = sum(lx) / len(lx)
+    my = sum(ly) / len(ly)
+    sxx = sum((x - mx) ** 2 for x in lx)
+    b = default[1]
+    if len(points) > 1 and sxx > 1e-6:
+        b = sum((x - mx) * (y - my) for x, y in zip(lx, ly)) / sxx
+        b = min(max(b, 0.3), 3.0)
+    return (math.exp(my - b * mx), b)
+
+def calibrate (s, runs):
+    work_points = []
+    memory_points = []
+    for d, cores, wall, rss in runs.get(s.name, []):
+        used_cores = min(cores, s.processes(d) * s.threads)
+        work_points.append((s.size(d), wall * used_cores))
+        memory_points.append((s.size(d) / max(s.processes(d), 1), rss))
+    return fit_power_law(work_points, s.work), fit_power_law(memory_points, s.memory), len(work_points)
+
+# returns cpu count and total memory in MB of this machine
+def machine ():
+    cores = multiprocessing.cpu_count()
+    memory = None
+    try:
+        f = open("/proc/meminfo", "r")
+        for line in f:
+            if line.startswith("MemTotal:"):
+                memory = int(line.split()[1]) / 1024.0
+        f.close()
+    except IOError:
+        pass
+    return cores, memory
+
+# predicts wall seconds, peak MB and temporary disk MB of a stage
+def predict (s, d, cores, work_model, memory_model, memory_limit):
+    size = s.size(d)
+    processes = max(s.processes(d), 1)
+    work = work_model[0] * size ** work_model[1]
+    process_memory = memory_model[0] * (size / processes) ** memory_model[1]
+    workers = min(processes, max(cores // s.threads, 1))
+    if memory_limit:
+        workers = max(1, min(workers, int(memory_limit / max(process_memory, 1))))
+    # the largest job of a stage bounds its wall time
+    largest = 1.0 / processes
+    if s.name == "phasing":
+        jobs = d.phasing_jobs()
+        largest = max(jobs) / float(sum(jobs))
+    wall = max(work / min(workers * s.threads, cores), work * largest / s.threads)
+    return wall, process_memory * workers, s.disk(d) / MB, workers
+
+def format_time (seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+# reads the dimensions of a data set
+def read_dimensions (prefix, donor_pops, recipient_pops, bootstraps, shards, window, overlap):
+    samples = donors = recipients = 0
+    f = open(prefix + ".fam", "r")
+    for line in f:
+        pop = line.split()[0]
+        samples += 1
+        if pop in donor_pops:
+            donors += 1
+        elif pop in recipient_pops:
+            recipients += 1
+    f.close()
+
+    regions = read_regions(prefix + ".regions") if os.path.isfile(prefix + ".regions") else []
+
+    markers = {}
+    map_filename = prefix + ".bim" if os.path.isfile(prefix + ".bim") else prefix + ".map"
+    f = open(map_filename, "r")
+    for line in f:
+        data = line.split()
+        chromosome, position = data[0], int(data[3])
+        if regions and not in_regions(chromosome, position, regions):
+            continue
+        markers[chromosome] = markers.get(chromosome, 0) + 1
+    f.close()
+    return dimensions(samples, markers, donors, recipients, bootstraps, shards, window, overlap)
+
+# suggested number of concurrent processes of a stage on this machine
+def suggested_jobs (name, d, benchmarks_filename):
+    cores, memory = machine()
+    runs = read_benchmarks(benchmarks_filename)
+    for s in STAGES:
+        if s.name == name:
+            work_model, memory_model, n = calibrate(s, runs)
+            return predict(s, d, cores, work_model, memory_model, memory)[3]
+    sys.stderr.write ("ERROR: Unknown stage: " + name + "\n")
+    sys.exit(1)
+
+def plan_run (d, benchmarks_filename):
+    cores, memory = machine()
+    runs = read_benchmarks(benchmarks_filename)
+
+    print ("Data: %d individuals (%d donors, %d recipients), %d markers on %d chromosomes" % (d.samples, d.donors, d.recipients, d.total_markers(), len(d.markers)))
+    print ("Machine: %d cores, %s MB memory" % (cores, "%d" % memory if memory else "unknown"))
+    print ("")
+    print ("stage\twall\tpeak memory (MB)\ttemp disk (MB)\tworkers\tmodel")
+    total_wall = total_disk = peak = 0
+    suggestions = {}
+    for s in STAGES:
+        work_model, memory_model, n = calibrate(s, runs)
+        wall, stage_memory, disk, workers = predict(s, d, cores, work_model, memory_model, memory)
+        total_wall += wall
+        total_disk += disk
+        peak = max(peak, stage_memory)
+        suggestions[s.name] = workers
+        print ("%s\t%s\t%d\t%d\t%d\t%s" % (s.name, format_time(wall), stage_memory, disk, workers, ("%d recorded runs" % n) if n else "default"))
+    print ("total\t%s\t%d\t%d" % (format_time(total_wall), peak, total_disk))
+    print ("")
+
+    # suggested settings of script.sh
+    jobs = suggestions["phasing"]
+    window = int(math.ceil(d.total_markers() / float(max(jobs, 1)))) + d.overlap
+    print ("Suggestions:")
+    print ("  phasing: %d concurrent Beagle jobs (4 threads each), i.e. WINDOW=%d OVERLAP=%d" % (jobs, max(window, 5000), d.overlap))
+    print ("  painting: %d concurrent ChromoPainter runs" % suggestions["painting"])
+    print ("  GLOBETROTTER: GT_SHARDS=%d" % max(1, min(cores, d.bootstraps)))
+    if memory and peak > memory:
+        print ("  WARNING: predicted peak memory %d MB exceeds the memory of this machine" % peak)
+
+
+# get options from commandline
+prefix = sys.argv[1]
+cmd_line = sys.argv[2:]
+donors = []
+recipients = []
+options = {"-w" : 10000, "-o" : 1000, "-b" : 20, "-s" : 4}
+benchmarks_filename = os.path.join(os.path.dirname(prefix), "benchmarks.tsv")
+print_dimensions = False
+jobs_stage = None
+i = 0
+while i < len(cmd_line):
+    if cmd_line[i] in ["-d", "-r"]:
+        populations = donors if cmd_line[i] == "-d" else recipients
+        while i + 1 < len(cmd_line) and cmd_line[i + 1][0] != "-":
+            populations.append (cmd_line[i + 1])
+            i += 1
+    elif cmd_line[i] in options and i + 1 < len(cmd_line):
+        options[cmd_line[i]] = int(cmd_line[i + 1])
+        i += 1
+    elif cmd_line[i] == "--benchmarks" and i + 1 < len(cmd_line):
+        benchmarks_filename = cmd_line[i + 1]
+        i += 1
+    elif cmd_line[i] == "--dimensions":
+        print_dimensions = True
+    elif cmd_line[i] == "--jobs" and i + 1 < len(cmd_line):
+        jobs_stage = cmd_line[i + 1]
+        i += 1
+    else:
+        sys.stderr.write ("ERROR: Unknown commandline parameter: " + cmd_line[i] + "\n")
+    i += 1
+
+d = read_dimensions(prefix, donors, recipients, options["-b"], options["-s"], options["-w"], options["-o"])
+if print_dimensions:
+    print ("\t".join(str(x) for x in [d.samples, d.total_markers(), d.donors, d.recipients, d.bootstraps, d.shards, d.window, d.overlap]))
+elif jobs_stage:
+    print (suggested_jobs(jobs_stage, d, benchmarks_filename))
+else:
+    plan_run(d, benchmarks_filename)
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+
+import sys
+
+# writes a plink keep file of the individuals in the .fam file that do not
+# have haplotypes yet and returns their number
+def select_new_samples (prefix):
+    f = open (prefix + ".hapids", "r")
+    phased = set(line.strip() for line in f)
+    f.close()
+
+    n = 0
+    fr = open (prefix + ".fam", "r")
+    fw = open (prefix + ".new.keep", "w")
+    for line in fr:
+        ind = line.strip().split()
+        if ind[1] not in phased:
+            fw.write (ind[0] + "\t" + ind[1] + "\n")
+            n += 1
+    fw.close()
+    fr.close()
+    return n
+
+prefix = sys.argv[1]
+print (select_new_samples (prefix))
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import sys
+import gzip
+
+# opens a (possibly gzipped) vcf file
+def open_vcf (filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    return open(filename, "r")
+
+# skips the header of a vcf file, returns header lines and the first data line
+def read_header (vcf_file):
+    header = []
+    for line in vcf_file:
+        if line[0] != "#":
+            return header, line
+        header.append(line)
+    return header, None
+
+# swaps the two haplotypes of the GT field of one sample
+def flip_genotype (field):
+    gt, sep, rest = field.partition(":")
+    alleles = gt.split("|")
+    if len(alleles) != 2:
+        return field
+    return alleles[1] + "|" + alleles[0] + sep + rest
+
+# applies haplotype flips to one vcf data line
+def flip_line (line, flips):
+    if not any(flips):
+        return line
+    data = line.rstrip("\n").split("\t")
+    for i, flip in enumerate(flips):
+        if flip:
+            data[9 + i] = flip_genotype(data[9 + i])
+    return "\t".join(data) + "\n"
+
+# counts for every sample how many heterozygous overlap sites agree in the
+# current and in the swapped haplotype orientation
+def orientation_scores (left_lines, right_lines, n_samples):
+    same = [0] * n_samples
+    swapped = [0] * n_samples
+    for left, right in zip(left_lines, right_lines):
+        left_data = left.rstrip("\n").split("\t")
+        right_data = right.rstrip("\n").split("\t")
+        for i in range(n_samples):
+            l = left_data[9 + i].split(":")[0]
+            r = right_data[9 + i].split(":")[0]
+            if l[0] == l[-1] or r[0] == r[-1]:
+                continue
+            if l == r:
+                same[i] += 1
+            else:
+                swapped[i] += 1
+    return same, swapped
+
+# joins phased vcf files of overlapping marker windows into one vcf file
+# in every overlap the orientation of the right window is chosen to agree
+# best with the left window, the overlap is cut at its midpoint
+def stitch_phased_windows (output_filename, window_filenames):
+    output_file = gzip.open(output_filename, "wb")
+
+    left_file = open_vcf(window_filenames[0])
+    header, line = read_header(left_file)
+    output_file.writelines(header)
+    n_samples = len(header[-1].rstrip("\n").split("\t")) - 9
+    left_flips = [False] * n_samples
+
+    for window_filename in window_filenames[1:]:
+        right_file = open_vcf(window_filename)
+        right_header, right_line = read_header(right_file)
+        if right_line is None:
+            right_file.close()
+            continue
+        right_start = right_line.split("\t", 2)[:2]
+
+        # write the left window up to the first marker of the right window
+        overlap = []
+        while line is not None:
+            if line.split("\t", 2)[:2] == right_start or overlap:
+                overlap.append(flip_line(line, left_flips))
+            else:
+                output_file.write(flip_line(line, left_flips))
+            line = left_file.readline() or None
+        left_file.close()
+
+        # read the same markers from the right window
+        right_overlap = []
+        while right_line is not None and len(right_overlap) < len(overlap):
+            if right_line.split("\t", 2)[:2] != overlap[len(right_overlap)].split("\t", 2)[:2]:
+                sys.stderr.write("ERROR: markers of " + window_filename + " do not match the previous window\n")
+                sys.exit(1)
+            right_overlap.append(right_line)
+            right_line = right_file.readline() or None
+
+        same, swapped = orientation_scores(overlap, right_overlap, n_samples)
+        right_flips = [s > a for a, s in zip(same, swapped)]
+
+        middle = len(overlap) // 2
+        output_file.writelines(overlap[:middle])
+        for right in right_overlap[middle:]:
+            output_file.write(flip_line(right, right_flips))
+
+        left_file = right_file
+        left_flips = right_flips
+        line = right_line
+
+    while line is not None:
+        output_file.write(flip_line(line, left_flips))
+        line = left_file.readline() or None
+    left_file.close()
+    output_file.close()
+
+
+output = sys.argv[1]
+windows = sys.argv[2:]
+stitch_phased_windows (output, windows)
@@ -4,14 +4,24 @@
 
 path=$1
 
-for i in $(seq 21 22); do
-	gunzip $1.$i.phased.vcf.gz
-	if [ $i -eq 21 ]; 
+header=1
+for i in $(seq 1 22); do
+	# chromosome files are read compressed if they are compressed
+	if [ -f $1.$i.phased.vcf.gz ]; then
+		file=$1.$i.phased.vcf.gz
+	elif [ -f $1.$i.phased.vcf ]; then
+		file=$1.$i.phased.vcf
+	else
+		# chromosomes without markers (i.e. outside the regions) are not phased
+		continue
+	fi
+	if [ $header -eq 1 ]; 
 	then
 		# get the whole first chromosome file
-		cat $1.$i.phased.vcf
+		gzip -dcf $file
+		header=0
 	else
 		# get data from chromosome file
-		grep -v "#" $1.$i.phased.vcf
+		gzip -dcf $file | grep -v "#"
 	fi
-done
\ No newline at end of file
+done
@@ -12,6 +12,93 @@
 ## constants
 DATAPATH="./data/"
 PREFIX="xingnorel"
+# phasing window and overlap sizes in markers, WINDOW=0 phases whole chromosomes
+WINDOW=10000
+OVERLAP=1000
+# maximum number of concurrent Beagle runs of all chromosomes and windows,
+# if empty the number suggested by ./pipeline/plan_run.py is used
+MAX_JOBS=""
+# GLOBETROTTER bootstraps and the number of parallel runs they are split into
+GT_BOOTSTRAPS=20
+GT_SHARDS=4
+# comma separated chromosome:start-end regions, i.e. "1:1000000-5000000,22"
+# if set, the pipeline runs only on markers inside the regions in DATAPATH/regions/
+REGIONS=""
+# ChromoPainter parameters are estimated on every EM_THIN_EVERY-th marker at
+# least EM_THIN_BP bp apart, 1 and 0 estimate them on all markers
+EM_THIN_EVERY=1
+EM_THIN_BP=0
+# HapMap style genetic map (Chromosome, Position(bp), Rate(cM/Mb), Map(cM)) for
+# the recombination rates, if empty a constant rate is used
+GENETIC_MAP=""
+# recombination rates computed from the map are cached here by marker set
+RATECACHE="${DATAPATH}ratecache/"
+# STREAM=1 joins the stages of phasing and conversion with named pipes
+# instead of temporary files
+STREAM=0
+export STREAM
+# recorded stage runs for ./pipeline/plan_run.py
+BENCHMARKS="${DATAPATH}benchmarks.tsv"
+ARGS="$@"
+
+## runs a pipeline stage, prints its wall time and records it together with
+## the dimensions of the data set in BENCHMARKS
+## stages write a line "run" (a Beagle job or a painted recipient) or "em" (an
+## EM run of ChromoPainter) to $BENCHMARK_RUNS for every process they start,
+## their counts are recorded too, "-" if the stage does not count its processes
+benchmark () {
+	stage=$1
+	shift
+	dimensions=$(python ./pipeline/plan_run.py ${DATAPATH}${PREFIX} --dimensions -w $WINDOW -o $OVERLAP -b $GT_BOOTSTRAPS -s $GT_SHARDS $ARGS)
+	rm -f ${BENCHMARKS}.runs
+	BENCHMARK_RUNS=${BENCHMARKS}.runs time -o ${BENCHMARKS}.last -f "%E\t%e\t%M" "$@"
+	status=$?
+	runs=- ; em=-
+	if [ -f ${BENCHMARKS}.runs ]; then
+		runs=$(grep -c "^run" ${BENCHMARKS}.runs)
+		em=$(grep -c "^em" ${BENCHMARKS}.runs)
+		rm -f ${BENCHMARKS}.runs
+	fi
+	printf "%s\t%s\t%s\t%s\t%s\t%s\n" $stage "$dimensions" $(nproc) "$(tail -n 1 ${BENCHMARKS}.last | cut -f 2,3)" $runs $em >> $BENCHMARKS
+	tail -n 1 ${BENCHMARKS}.last | cut -f 1
+	return $status
+}
+
+## checks that Beagle phases a small data set it reads from a named pipe,
+## i.e. that it reads its input in one pass
+beagle_reads_pipe () {
+	probe=${DATAPATH}chrom/.beagle_probe
+	rm -f $probe.*
+	mkfifo $probe.vcf
+	awk 'BEGIN {
+		srand(1)
+		print "##fileformat=VCFv4.1"
+		header = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT"
+		for (s = 1; s <= 20; s++) header = header "\tS" s
+		print header
+		for (m = 1; m <= 50; m++) {
+			line = "1\t" m * 1000 "\trs" m "\tA\tG\t.\tPASS\t.\tGT"
+			for (s = 1; s <= 20; s++) line = line "\t" int(rand() * 2) "/" int(rand() * 2)
+			print line
+		}
+	}' > $probe.vcf &
+	writer=$!
+	timeout 300 java -Xmx1000m -jar ./beagle.r1398.jar gt=$probe.vcf out=$probe nthreads=1 > /dev/null 2>&1
+	probe_status=$?
+	# drains the pipe if Beagle stopped reading it
+	cat <> $probe.vcf > /dev/null &
+	drain=$!
+	wait $writer
+	kill $drain
+	wait
+	if [ $probe_status -eq 0 ] && [ -s $probe.vcf.gz ]; then
+		probe_status=0
+	else
+		probe_status=1
+	fi
+	rm -f $probe.*
+	return $probe_status
+}
 
 echo
 echo "Starting HUMAN ADMIXTURE PIPELINE"
@@ -22,45 +109,141 @@ echo
 ## .bed to .ped
 if [ ! -f ${DATAPATH}${PREFIX}.ped ]; then 
 	printf "Converting ${DATAPATH}${PREFIX}.bed to PED format..."
-	time -f %E ./plink --noweb --bfile ${DATAPATH}${PREFIX} --recode --tab --out ${DATAPATH}${PREFIX} --silent
+	benchmark plink ./plink --noweb --bfile ${DATAPATH}${PREFIX} --recode --tab --out ${DATAPATH}${PREFIX} --silent
 	echo
 	# Takes 1.5 min
 fi
 
-## phasing pipeline
-if [ -f ${DATAPATH}${PREFIX}.phased.vcf.gz ]; then
-	gunzip ${DATAPATH}${PREFIX}.phased.vcf.gz
+## region restricted runs work in their own directory on the same input data
+if [ -n "$REGIONS" ]; then
+	REGIONPATH=${DATAPATH}regions/$(echo "$REGIONS" | tr ':,' '_+')/
+	echo "Restricting the analysis to regions $REGIONS in $REGIONPATH"
+	mkdir -p $REGIONPATH
+	# an existing genome-wide phasing is reused
+	for suffix in .ped .map .fam .bed .bim .phased.vcf .phased.vcf.gz; do
+		if [ -f ${DATAPATH}${PREFIX}$suffix ]; then
+			ln -sf $(readlink -f ${DATAPATH}${PREFIX}$suffix) ${REGIONPATH}${PREFIX}$suffix
+		fi
+	done
+	echo "$REGIONS" > ${REGIONPATH}${PREFIX}.regions
+	GENOMEPATH=$DATAPATH
+	DATAPATH=$REGIONPATH
+fi
+
+## concurrent Beagle runs of phasing and incremental phasing
+if [ -z "$MAX_JOBS" ]; then
+	MAX_JOBS=$(python ./pipeline/plan_run.py ${DATAPATH}${PREFIX} --jobs phasing -w $WINDOW -o $OVERLAP $ARGS)
 fi
-if [ ! -f ${DATAPATH}${PREFIX}.phased.vcf ]; then
+export MAX_JOBS
+
+## phasing pipeline
+if [ ! -f ${DATAPATH}${PREFIX}.phased.vcf ] && [ ! -f ${DATAPATH}${PREFIX}.phased.vcf.gz ]; then
 	echo "Phasing the data..."
 	mkdir -p ${DATAPATH}chrom
+	STREAM_BEAGLE=0
+	if [ "$STREAM" = "1" ]; then
+		if beagle_reads_pipe; then
+			STREAM_BEAGLE=1
+		else
+			echo "Beagle does not read its input from a named pipe, writing .vcf files for it"
+		fi
+	fi
+	export STREAM_BEAGLE
 	# change the loop if you have different chromosome numbers than 1 to 22
-	for i in $(seq 1 22); do
-		./pipeline/beagle.sh ${DATAPATH} ${PREFIX} $i &
-	done
-	wait
+	benchmark phasing sh -c "for i in \$(seq 1 22); do ./pipeline/beagle.sh ${DATAPATH} ${PREFIX} \$i $WINDOW $OVERLAP & done; wait"
 	echo	
-	printf "Concatenating data..."
-	time -f %E ./pipeline/union.sh ${DATAPATH}chrom/${PREFIX} > ${DATAPATH}${PREFIX}.phased.vcf
-	echo
-	gzip ${DATAPATH}${PREFIX}.phased.vcf
+	if [ "$STREAM" = "1" ]; then
+		# the conversion reads the concatenated data while it is compressed to disk,
+		# the compressed file is kept only if every process of the stream succeeded
+		phased=${DATAPATH}${PREFIX}.phased.vcf
+		rm -f ${DATAPATH}${PREFIX}.haplotypes $phased $phased.gz.tmp $phased.failed
+		mkfifo $phased
+		{ ./pipeline/union.sh ${DATAPATH}chrom/${PREFIX} || echo union >> $phased.failed; } | { tee $phased || echo tee >> $phased.failed; } | { gzip || echo gzip >> $phased.failed; } > $phased.gz.tmp &
+		stream=$!
+		drain=""
+		printf "Concatenating data and creating input files for ChromoPainter v2..."
+		if ! benchmark conversion python ./pipeline/beagle_to_chromopainter_convert.py ${DATAPATH}${PREFIX} $REGIONS thin_every=$EM_THIN_EVERY thin_bp=$EM_THIN_BP ${GENETIC_MAP:+genetic_map=$GENETIC_MAP rate_cache=$RATECACHE}; then
+			echo conversion >> $phased.failed
+			# drains the pipe so that tee finishes, also if it has not opened it yet
+			cat <> $phased > /dev/null &
+			drain=$!
+		fi
+		wait $stream
+		if [ -n "$drain" ]; then
+			kill $drain
+		fi
+		wait
+		rm -f $phased
+		if [ -f $phased.failed ]; then
+			echo "ERROR: streaming the phased data failed in: $(cat $phased.failed)" >&2
+			rm -f $phased.gz.tmp $phased.failed ${DATAPATH}${PREFIX}.haplotypes ${DATAPATH}${PREFIX}.recomrates
+			exit 1
+		fi
+		mv $phased.gz.tmp $phased.gz
+	else
+		printf "Concatenating data..."
+		time -f %E ./pipeline/union.sh ${DATAPATH}chrom/${PREFIX} > ${DATAPATH}${PREFIX}.phased.vcf
+		echo
+		gzip ${DATAPATH}${PREFIX}.phased.vcf
+	fi
 	#rm -fr ${DATAPATH}chrom
 fi
 
 ## Beagle output to ChromoPainter input conversion
-if [ ! -f ${DATAPATH}${PREFIX}.haplotypes ] || [  ! -f ${DATAPATH}${PREFIX}.recomrates ]; then
+if [ ! -f ${DATAPATH}${PREFIX}.haplotypes ] || [  ! -f ${DATAPATH}${PREFIX}.recomrates ] || [ ! -f ${DATAPATH}${PREFIX}.alleles ]; then
 	printf "Creating input files for ChromoPainter v2..."
-	time -f %E python ./pipeline/beagle_to_chromopainter_convert.py ${DATAPATH}${PREFIX}
+	benchmark conversion python ./pipeline/beagle_to_chromopainter_convert.py ${DATAPATH}${PREFIX} $REGIONS thin_every=$EM_THIN_EVERY thin_bp=$EM_THIN_BP ${GENETIC_MAP:+genetic_map=$GENETIC_MAP rate_cache=$RATECACHE}
+# only the recombination rates are rewritten when the genetic map has changed,
+# the haplotypes keep the individuals added incrementally
+elif [ -n "$GENETIC_MAP" -a "$GENETIC_MAP" -nt ${DATAPATH}${PREFIX}.recomrates ]; then
+	printf "Updating recombination rates for ChromoPainter v2..."
+	time -f %E python ./pipeline/beagle_to_chromopainter_convert.py ${DATAPATH}${PREFIX} thin_every=$EM_THIN_EVERY thin_bp=$EM_THIN_BP genetic_map=$GENETIC_MAP rate_cache=$RATECACHE update=rates || exit 1
+fi
+# the thinned files of the parameter estimation are rewritten from the existing
+# haplotypes, or removed, when EM_THIN_EVERY or EM_THIN_BP have changed
+if [ "$(cat ${DATAPATH}${PREFIX}.em.settings 2>/dev/null)" != "thin_every=$EM_THIN_EVERY thin_bp=$EM_THIN_BP" ]; then
+	printf "Updating thinned input files for ChromoPainter v2 parameter estimation..."
+	time -f %E python ./pipeline/beagle_to_chromopainter_convert.py ${DATAPATH}${PREFIX} thin_every=$EM_THIN_EVERY thin_bp=$EM_THIN_BP update=em || exit 1
+fi
+
+## incremental addition of individuals that are new in the .fam file
+if [ -f ${DATAPATH}${PREFIX}.hapids ]; then
+	nnew=$(python ./pipeline/select_new_samples.py ${DATAPATH}${PREFIX})
+	if [ $nnew -gt 0 ]; then
+		echo "Phasing $nnew new individuals against the phased data..."
+		./plink --noweb --bfile ${DATAPATH}${PREFIX} --keep ${DATAPATH}${PREFIX}.new.keep --recode --tab --out ${DATAPATH}${PREFIX}.new --silent
+		if [ -n "$REGIONS" ]; then
+			# new individuals are phased in the same regions, against the
+			# genome-wide panel if the regions reused the genome-wide phasing
+			cp ${DATAPATH}${PREFIX}.regions ${DATAPATH}${PREFIX}.new.regions
+			mkdir -p ${DATAPATH}chrom
+			for i in $(seq 1 22); do
+				for panel in ${PREFIX}.$i.phased.vcf.gz ${PREFIX}.$i.phased.vcf; do
+					if [ ! -f ${DATAPATH}chrom/$panel ] && [ -f ${GENOMEPATH}chrom/$panel ]; then
+						ln -sf $(readlink -f ${GENOMEPATH}chrom/$panel) ${DATAPATH}chrom/$panel
+					fi
+				done
+			done
+		fi
+		for i in $(seq 1 22); do
+			./pipeline/beagle.sh ${DATAPATH} ${PREFIX}.new $i $WINDOW $OVERLAP ${PREFIX} &
+		done
+		wait
+		./pipeline/union.sh ${DATAPATH}chrom/${PREFIX}.new > ${DATAPATH}${PREFIX}.new.phased.vcf
+		printf "Adding haplotypes of new individuals..."
+		time -f %E python ./pipeline/append_haplotypes.py ${DATAPATH}${PREFIX} ${DATAPATH}${PREFIX}.new.phased.vcf || exit 1
+		rm -f ${DATAPATH}chrom/${PREFIX}.new.*
+	fi
 fi
 nsamples=$(./pipeline/create_population_list_infile_and_idfile.py ${DATAPATH}${PREFIX} $@)
 
 ## ChromoPainter
 printf "Running ChromoPainterv2..."
-time -f %E ./pipeline/chromopainter.sh ${DATAPATH} ${PREFIX} $nsamples
+benchmark painting ./pipeline/chromopainter.sh ${DATAPATH} ${PREFIX} $nsamples
 
 ## GLOBETROTTER
 printf "Running GLOBETROTTER..."
-time -f %E R < GLOBETROTTER.R ${DATAPATH}${PREFIX}.param ${DATAPATH}${PREFIX}.samples.out ${DATAPATH}${PREFIX}.recomrate --no-save > ${DATAPATH}${PREFIX}.globetrotter.log
+benchmark globetrotter python ./pipeline/globetrotter_bootstrap.py ${DATAPATH}${PREFIX} $GT_SHARDS $GT_BOOTSTRAPS
 
 
 